@@ -29,6 +29,7 @@ representation in retroforth ( http://retroforth.org/ )
 from pl0_node_visitor import StackingNodeVisitor
 import sys
 import pl0_parser
+import pl0_optimizer
 import StringIO
 import os
 import types
@@ -289,5 +290,9 @@ if __name__ == '__main__':
     parser = pl0_parser.Parser()
     parser.input(code)
     program = parser.p_program()
+
+    if '--optimize' in sys.argv:
+        program = pl0_optimizer.Optimizer().optimize(program)
+
     compiler = RetroTranspiler()
     compiler.visit_node(program)
@@ -22,6 +22,7 @@
 #
 
 import pl0_machine
+import pl0_bytecode
 import sys
 import StringIO
 import re
@@ -37,9 +38,41 @@ def is_integer(string):
         return False
     return True
 
-def assemble(input):
-    buffer = []
-    labels = {}
+class Assembler:
+    """
+    Builds a sequence from labels, instructions and data words. The
+    compiler can emit straight into an assembler, see pl0_compiler.TextEmitter,
+    so that source becomes a sequence without writing and parsing text.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.labels = {}
+
+    def entry(self, name):
+        self.instruction('JMP', name)
+
+    def label(self, name):
+        self.labels[name] = len(self.buffer)
+
+    def data(self, value):
+        self.buffer.append(value)
+
+    def comment(self, text):
+        pass
+
+    def instruction(self, name, *operands):
+        self.buffer.append(pl0_machine.OPCODES[name])
+        self.buffer.extend(operands)
+
+    def code(self):
+        # This updates any indirect labels
+        return list(self.labels.get(x, x) for x in self.buffer)
+
+def assemble_with_labels(input):
+    assembler = Assembler()
+    buffer = assembler.buffer
+
     for line in input:
         if comment_re.match(line):
             continue
@@ -52,7 +85,7 @@ def assemble(input):
             continue
 
         if match:
-            labels[match.group(1)] = len(buffer)
+            assembler.label(match.group(1))
         else:
             command = re.split(whitespace_re, line.strip())
 
@@ -65,9 +98,18 @@ def assemble(input):
                     # A label
                     buffer.append(argument)
 
-    # This updates any indirect labels
-    return list(labels.get(x, x) for x in buffer)
+    return assembler.code(), assembler.labels
+
+def assemble(input):
+    code, labels = assemble_with_labels(input)
+    return code
 
 if __name__ == '__main__':
-    code = assemble(sys.stdin)
-    print `code`
+    code, labels = assemble_with_labels(sys.stdin)
+
+    if '--binary' in sys.argv:
+        image = pl0_machine.decode(code)
+        image.symbols = labels
+        pl0_bytecode.write_image(sys.stdout, image)
+    else:
+        print `code`
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import ast
+import numpy
+import pl0_machine
+import pl0_bytecode
+import pl0_compiler
+from pl0_machine import *
+
+class BatchMachine:
+    """
+    Runs many instances of one decoded image in lockstep. Each instance
+    has its own row in the data segment and the stack, and its own
+    instruction index. Every step executes the lowest instruction index
+    amongst the running instances, for all instances which are at that
+    index, so instances which diverge at a conditional jump wait for
+    each other and reconverge after the branch.
+
+    Values are 64-bit integers, so arithmetic wraps around where Machine
+    would switch to long integers.
+    """
+
+    def __init__(self, image, data):
+        self.image = image
+        self.data = numpy.array(data, dtype = numpy.int64)
+
+        count = len(self.data)
+        self.pc = numpy.zeros(count, dtype = numpy.int64)
+        self.stack = numpy.zeros((count, 16), dtype = numpy.int64)
+        self.sp = numpy.zeros(count, dtype = numpy.int64)
+        self.faulted = numpy.zeros(count, dtype = bool)
+
+        # Activation records, laid out as in pl0_machine.Frames.
+        self.frames = numpy.zeros((count, 64), dtype = numpy.int64)
+        self.fp = numpy.zeros(count, dtype = numpy.int64)
+        self.frame_top = numpy.zeros(count, dtype = numpy.int64) + 2
+
+        # Printed values, as (instances, values) pairs in the order they were printed.
+        self.printed = []
+
+        # Maps return addresses, which are sequence offsets, back to instruction indices.
+        self.index = numpy.zeros(max(image.addresses) + 1, dtype = numpy.int64) - 1
+        self.index[image.addresses] = numpy.arange(len(image.addresses))
+
+        self.table = [None] * (max(NAMES) + 1)
+        for opcode, name in NAMES.iteritems():
+            self.table[opcode] = getattr(self, "execute_%s" % name.lower())
+
+    @classmethod
+    def repeat(cls, image, count):
+        # Every instance starts from the initial data segment of the image.
+        return cls(image, numpy.tile(image.data, (count, 1)))
+
+    def run(self):
+        code = self.image.code
+        table = self.table
+        pc = self.pc
+
+        while True:
+            running = pc[pc >= 0]
+
+            if len(running) == 0:
+                break
+
+            current = running.min()
+            instances = numpy.flatnonzero(pc == current)
+
+            opcode, operand = code[current]
+            table[opcode](instances, operand, current)
+
+    def outputs(self):
+        # The values printed by each instance, in order.
+        result = [[] for i in xrange(len(self.data))]
+
+        for instances, values in self.printed:
+            for instance, value in zip(instances.tolist(), values.tolist()):
+                result[instance].append(value)
+
+        return result
+
+    def push(self, instances, values):
+        if self.sp.max() >= self.stack.shape[1]:
+            self.stack = numpy.hstack([self.stack, numpy.zeros_like(self.stack)])
+
+        self.stack[instances, self.sp[instances]] = values
+        self.sp[instances] += 1
+
+    def pop(self, instances):
+        if (self.sp[instances] == 0).any():
+            raise IndexError("pop from empty stack")
+
+        self.sp[instances] -= 1
+        return self.stack[instances, self.sp[instances]]
+
+    def top(self, instances):
+        return self.stack[instances, self.sp[instances] - 1]
+
+    def execute_nop(self, instances, operand, pc):
+        self.pc[instances] = pc + 1
+
+    def execute_halt(self, instances, operand, pc):
+        self.pc[instances] = -1
+
+    def execute_load(self, instances, address, pc):
+        self.push(instances, self.data[instances, address])
+        self.pc[instances] = pc + 1
+
+    def execute_save(self, instances, address, pc):
+        self.data[instances, address] = self.pop(instances)
+        self.pc[instances] = pc + 1
+
+    def execute_push(self, instances, value, pc):
+        self.push(instances, value)
+        self.pc[instances] = pc + 1
+
+    def execute_pop(self, instances, operand, pc):
+        self.pop(instances)
+        self.pc[instances] = pc + 1
+
+    def execute_dup(self, instances, operand, pc):
+        self.push(instances, self.top(instances))
+        self.pc[instances] = pc + 1
+
+    def execute_jmp(self, instances, address, pc):
+        self.pc[instances] = address
+
+    def execute_call(self, instances, address, pc):
+        self.push(instances, self.image.addresses[pc + 1])
+        self.pc[instances] = address
+
+    def execute_ret(self, instances, operand, pc):
+        self.pc[instances] = self.index[self.pop(instances)]
+
+    def frame(self, instances, depth):
+        fp = self.fp[instances]
+
+        for i in xrange(depth):
+            fp = self.frames[instances, fp]
+
+        return fp
+
+    def execute_enter(self, instances, operand, pc):
+        depth, size = operand
+        fp = self.frame_top[instances]
+        top = fp + 2 + size
+
+        while top.max() > self.frames.shape[1]:
+            self.frames = numpy.hstack([self.frames, numpy.zeros_like(self.frames)])
+
+        self.frames[instances, fp] = self.frame(instances, depth)
+        self.frames[instances, fp + 1] = self.fp[instances]
+
+        for slot in xrange(size):
+            self.frames[instances, fp + 2 + slot] = 0
+
+        self.fp[instances] = fp
+        self.frame_top[instances] = top
+        self.pc[instances] = pc + 1
+
+    def execute_leave(self, instances, operand, pc):
+        fp = self.fp[instances]
+        self.frame_top[instances] = fp
+        self.fp[instances] = self.frames[instances, fp + 1]
+        self.pc[instances] = pc + 1
+
+    def execute_loadl(self, instances, operand, pc):
+        depth, slot = operand
+        self.push(instances, self.frames[instances, self.frame(instances, depth) + 2 + slot])
+        self.pc[instances] = pc + 1
+
+    def execute_savel(self, instances, operand, pc):
+        depth, slot = operand
+        self.frames[instances, self.frame(instances, depth) + 2 + slot] = self.pop(instances)
+        self.pc[instances] = pc + 1
+
+    def execute_conditional(self, instances, address, pc):
+        opcode = self.image.code[pc][0]
+        taken = CONDITIONS[opcode](self.pop(instances))
+        self.pc[instances] = numpy.where(taken, address, pc + 1)
+
+    execute_jlt = execute_jlte = execute_je = execute_conditional
+    execute_jne = execute_jgte = execute_jgt = execute_conditional
+
+    def execute_comparison(self, instances, operand, pc):
+        opcode = self.image.code[pc][0]
+        b = self.pop(instances)
+        a = self.pop(instances)
+        self.push(instances, COMPARISONS[opcode](a, b))
+        self.pc[instances] = pc + 1
+
+    execute_cmplt = execute_cmplte = execute_cmpe = execute_comparison
+    execute_cmpne = execute_cmpgte = execute_cmpgt = execute_comparison
+
+    def execute_mul(self, instances, operand, pc):
+        self.push(instances, self.pop(instances) * self.pop(instances))
+        self.pc[instances] = pc + 1
+
+    def execute_div(self, instances, operand, pc):
+        b = self.pop(instances)
+        a = self.pop(instances)
+
+        # Instances which divide by zero stop, rather than the whole batch.
+        zero = a == 0
+        if zero.any():
+            self.faulted[instances[zero]] = True
+            self.pc[instances[zero]] = -1
+            instances, a, b = instances[~zero], a[~zero], b[~zero]
+
+        self.push(instances, b // a)
+        self.pc[instances] = pc + 1
+
+    def execute_add(self, instances, operand, pc):
+        self.push(instances, self.pop(instances) + self.pop(instances))
+        self.pc[instances] = pc + 1
+
+    def execute_sub(self, instances, operand, pc):
+        self.push(instances, self.pop(instances) - self.pop(instances))
+        self.pc[instances] = pc + 1
+
+    def execute_print(self, instances, operand, pc):
+        self.printed.append((instances, self.top(instances)))
+        self.pc[instances] = pc + 1
+
+    def execute_debug(self, instances, operand, pc):
+        # There is no single machine state to show.
+        self.pc[instances] = pc + 1
+
+    def execute_mark(self, instances, operand, pc):
+        self.pc[instances] = pc + 1
+
+    def execute_addvv(self, instances, operand, pc):
+        a, b = operand
+        self.push(instances, self.data[instances, b] + self.data[instances, a])
+        self.pc[instances] = pc + 1
+
+    def execute_jcmpvk(self, instances, operand, pc):
+        x, k, comparison, address = operand
+        passed = COMPARISONS[comparison](self.data[instances, x], k)
+        self.pc[instances] = numpy.where(passed, pc + 1, address)
+
+    def execute_savek(self, instances, operand, pc):
+        k, x = operand
+        self.data[instances, x] = k
+        self.pc[instances] = pc + 1
+
+    def execute_printpop(self, instances, operand, pc):
+        self.printed.append((instances, self.pop(instances)))
+        self.pc[instances] = pc + 1
+
+if __name__ == '__main__':
+    # Runs the program once for each line of initial data given as arguments, e.g. "1,2,3".
+    # The program is source, a binary image, or the sequence written by pl0_assembler.py.
+    path = sys.argv[1]
+
+    if path.endswith('.pl0'):
+        image = pl0_machine.decode(pl0_compiler.compile_source(open(path).read()))
+    else:
+        try:
+            image = pl0_bytecode.load_image(path)
+        except pl0_bytecode.FormatError:
+            image = pl0_machine.decode(ast.literal_eval(open(path).read()))
+
+    image = pl0_machine.fuse(image)
+
+    data = [[int(value) for value in argument.split(',')] for argument in sys.argv[2:]]
+    machine = BatchMachine(image, data)
+    machine.run()
+
+    for i, output in enumerate(machine.outputs()):
+        print "Instance %d: %r" % (i, output)
+        print "Data: %r" % machine.data[i].tolist()
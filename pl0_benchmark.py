@@ -0,0 +1,778 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import sys
+import ast
+import glob
+import time
+import resource
+import tempfile
+import StringIO
+import argparse
+import pl0_parser
+import pl0_compiler
+import pl0_assembler
+import pl0_machine
+import pl0_output
+import pl0_interpreter
+import pl0_closure_compiler
+import pl0_resolver
+import pl0_effects
+import pl0_bytecode
+import pl0_register_machine
+import pl0_pool
+import pl0_scheduler
+import pl0_budget
+import pl0_optimizer
+
+class NullOutput:
+    def write(self, data):
+        pass
+
+def compile_source(code, compiler_class = pl0_compiler.Compiler):
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = parser.p_program()
+
+    # The compiler writes assembly to stdout, so capture it for the assembler.
+    buffer = StringIO.StringIO()
+    stdout, sys.stdout = sys.stdout, buffer
+    try:
+        compiler_class().generate(program)
+    finally:
+        sys.stdout = stdout
+
+    return buffer.getvalue().splitlines()
+
+def assemble_source(code):
+    return pl0_compiler.compile_source(code)
+
+def count_steps(sequence):
+    machine = pl0_machine.Machine(list(sequence))
+    steps = 0
+
+    stdout, sys.stdout = sys.stdout, NullOutput()
+    try:
+        result = True
+        while result:
+            result = machine.step()
+            steps += 1
+    finally:
+        sys.stdout = stdout
+
+    return steps
+
+def reference_machine(sequence):
+    # The reference machine writes variables into the sequence, so each run needs a fresh copy.
+    return lambda: pl0_machine.Machine(list(sequence))
+
+def decoded_machine(sequence, image):
+    def create():
+        machine = pl0_machine.Machine(sequence)
+        machine.load(image)
+        return machine
+
+    return create
+
+def count_dispatches(sequence, image):
+    machine = decoded_machine(sequence, image)()
+    table = machine.dispatch_table()
+    code = image.code
+    pc = image.index[machine.offset]
+    steps = 0
+
+    stdout, sys.stdout = sys.stdout, NullOutput()
+    try:
+        while pc >= 0:
+            opcode, operand = code[pc]
+            pc = table[opcode](operand, pc)
+            steps += 1
+    finally:
+        sys.stdout = stdout
+
+    return steps
+
+def measure(run, create, repeat):
+    stdout, sys.stdout = sys.stdout, NullOutput()
+    try:
+        start = time.time()
+        for i in xrange(repeat):
+            run(create())
+        return time.time() - start
+    finally:
+        sys.stdout = stdout
+
+def report(name, steps, duration, baseline = None, unit = 'steps'):
+    line = "%-12s %10d %s %8.3fs %12.0f %s/s" % (name, steps, unit, duration, steps / duration, unit)
+
+    if baseline:
+        line += " %6.2fx" % (baseline / duration)
+
+    print line
+
+def benchmark_dispatch(path, iterations):
+    sequence = assemble_source(open(path).read())
+
+    # Scale the program up by running it repeatedly until we reach the requested number of steps.
+    steps = count_steps(sequence)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Dispatch: %s, %d steps per run, %d runs" % (path, steps, repeat)
+
+    baseline = measure(pl0_machine.Machine.run, reference_machine(sequence), repeat)
+    report("run", total, baseline)
+
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+    duration = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, image), repeat)
+    report("run_fast", total, duration, baseline)
+
+def benchmark_fusion(path, iterations):
+    sequence = assemble_source(open(path).read())
+
+    decoded = pl0_machine.decode(sequence)
+    fused = pl0_machine.fuse(decoded)
+
+    steps = count_dispatches(sequence, decoded)
+    repeat = max(1, iterations / steps)
+
+    print "Fusion: %s, %d runs" % (path, repeat)
+
+    for name, count in sorted(fused.fusions.items()):
+        print "%-12s %10d sites" % (name, count)
+
+    baseline = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, decoded), repeat)
+    report("decoded", steps * repeat, baseline)
+
+    dispatches = count_dispatches(sequence, fused)
+    duration = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, fused), repeat)
+    report("fused", dispatches * repeat, duration, baseline)
+
+    print "Dispatches saved: %d per run (%.1f%%)" % (steps - dispatches, 100.0 * (steps - dispatches) / steps)
+
+def benchmark_compiled(path, iterations):
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_steps(sequence)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Compiled: %s, %d steps per run, %d runs" % (path, steps, repeat)
+
+    baseline = measure(pl0_machine.Machine.run, reference_machine(sequence), repeat)
+    report("run", total, baseline)
+
+    duration = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, image), repeat)
+    report("run_fast", total, duration, baseline)
+
+    # Every run after the first reuses the cached translation.
+    duration = measure(pl0_machine.Machine.run_compiled, decoded_machine(sequence, image), repeat)
+    report("run_compiled", total, duration, baseline)
+
+def benchmark_traced(path, iterations):
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_dispatches(sequence, image)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Traced: %s, %d dispatches per run, %d runs" % (path, steps, repeat)
+
+    baseline = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, image), repeat)
+    report("run_fast", total, baseline)
+
+    machines = []
+    def create():
+        machines.append(decoded_machine(sequence, image)())
+        return machines[-1]
+
+    duration = measure(pl0_machine.Machine.run_traced, create, repeat)
+    report("run_traced", total, duration, baseline)
+
+    for name, value in sorted(machines[-1].tracer.statistics().items()):
+        print "%-20s %s" % (name, value)
+
+def benchmark_batch(path, iterations):
+    import numpy
+    import pl0_batch
+
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_dispatches(sequence, image)
+    count = max(1, iterations / steps)
+    data = numpy.random.randint(0, 100, (count, len(image.data)))
+
+    print "Batch: %s, %d dispatches per instance, %d instances" % (path, steps, count)
+
+    def create(row):
+        machine = pl0_machine.Machine(sequence)
+        machine.load(image)
+        machine.data = list(row)
+        return machine
+
+    rows = iter(data.tolist())
+    baseline = measure(pl0_machine.Machine.run_fast, lambda: create(next(rows)), count)
+    report("run_fast", steps * count, baseline)
+
+    start = time.time()
+    batch = pl0_batch.BatchMachine(image, data)
+    batch.run()
+    duration = time.time() - start
+    report("batch", steps * count, duration, baseline)
+
+def footprint(machine):
+    # Bytes used by the data segment and stack, including boxed integers for lists.
+    size = 0
+
+    for buffer in (machine.data, machine.stack):
+        size += sys.getsizeof(buffer)
+
+        if isinstance(buffer, list):
+            size += sum(sys.getsizeof(value) for value in buffer)
+
+    return size
+
+def benchmark_fixed(path, iterations):
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_dispatches(sequence, image)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Fixed: %s, %d dispatches per run, %d runs" % (path, steps, repeat)
+
+    machines = []
+    def create(machine_class):
+        def create():
+            machine = machine_class(sequence)
+            machine.load(image)
+            machines.append(machine)
+            return machine
+        return create
+
+    baseline = measure(pl0_machine.Machine.run_fast, create(pl0_machine.Machine), repeat)
+    report("run_fast", total, baseline)
+    print "%-12s %10d bytes of data and stack" % ("", footprint(machines[-1]))
+
+    duration = measure(pl0_machine.FixedMachine.run_fast, create(pl0_machine.FixedMachine), repeat)
+    report("fixed", total, duration, baseline)
+    print "%-12s %10d bytes of data and stack" % ("", footprint(machines[-1]))
+
+def synthetic_sequence(count):
+    # A straight-line program with count data slots and about 4 * count instructions.
+    OPCODES = pl0_machine.OPCODES
+    length = count * 5 + 3
+
+    sequence = [OPCODES['JMP'], length - count]
+    for i in xrange(count):
+        sequence += [OPCODES['PUSH'], i, OPCODES['SAVE'], length - count + i]
+    sequence += [OPCODES['HALT']]
+
+    return sequence + [0] * count
+
+def benchmark_load(path, iterations):
+    sequence = synthetic_sequence(max(1, iterations / 20))
+    image = pl0_machine.decode(sequence)
+
+    print "Load: synthetic program, %d words, %d instructions" % (len(sequence), len(image.code))
+
+    directory = tempfile.mkdtemp()
+    text_path = os.path.join(directory, 'program.txt')
+    binary_path = os.path.join(directory, 'program.pl0b')
+
+    try:
+        with open(text_path, 'w') as file:
+            file.write(`sequence`)
+
+        with open(binary_path, 'wb') as file:
+            pl0_bytecode.write_image(file, image)
+
+        def text_load(parse):
+            def load(path):
+                return pl0_machine.decode(parse(open(path).read()))
+            return load
+
+        timings = [
+            ("eval", text_load(eval), text_path),
+            ("literal_eval", text_load(ast.literal_eval), text_path),
+            ("binary", pl0_bytecode.load_image, binary_path),
+        ]
+
+        baseline = None
+        for name, load, path in timings:
+            start = time.time()
+            load(path)
+            duration = time.time() - start
+
+            line = "%-12s %10d bytes %8.3fs" % (name, os.path.getsize(path), duration)
+
+            if baseline:
+                line += " %6.2fx" % (baseline / duration)
+            else:
+                baseline = duration
+
+            print line
+    finally:
+        os.remove(text_path)
+        os.remove(binary_path)
+        os.rmdir(directory)
+
+def benchmark_profile(path, iterations):
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_dispatches(sequence, image)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Profile: %s, %d dispatches per run, %d runs" % (path, steps, repeat)
+
+    baseline = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, image), repeat)
+    report("run_fast", total, baseline)
+
+    duration = measure(pl0_machine.Machine.run_profiled, decoded_machine(sequence, image), repeat)
+    report("profiled", total, duration, baseline)
+
+    duration = measure(pl0_machine.Machine.run_recorded, decoded_machine(sequence, image), repeat)
+    report("recorded", total, duration, baseline)
+
+def count_register_steps(code, names):
+    machine = pl0_register_machine.RegisterMachine(code, names)
+    table = machine.dispatch_table()
+    pc = machine.pc
+    steps = 0
+
+    stdout, sys.stdout = sys.stdout, NullOutput()
+    try:
+        while pc >= 0:
+            instruction = code[pc]
+            pc = table[instruction[0]](instruction, pc)
+            steps += 1
+    finally:
+        sys.stdout = stdout
+
+    return steps
+
+def capture_output(run, machine):
+    buffer = StringIO.StringIO()
+    stdout, sys.stdout = sys.stdout, buffer
+    try:
+        run(machine)
+    finally:
+        sys.stdout = stdout
+
+    return buffer.getvalue()
+
+def benchmark_registers(path, iterations):
+    if path is None:
+        paths = glob.glob('tests/*.pl0') + glob.glob('examples/*.pl0')
+    elif os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, '*.pl0'))
+    else:
+        paths = [path]
+
+    # The iterations are shared between the programs.
+    iterations = max(1, iterations / len(paths))
+
+    print "Registers: %d programs, stack machine (run_fast) against register machine" % len(paths)
+    print "%-24s %10s %10s %8s %8s %8s %8s  %s" % ("program", "stack", "register", "ratio", "stack", "register", "speedup", "output")
+
+    for path in sorted(paths):
+        source = open(path).read()
+
+        sequence = assemble_source(source)
+        code, names = pl0_register_machine.assemble(compile_source(source, pl0_compiler.RegisterCompiler))
+
+        try:
+            image = pl0_machine.fuse(pl0_machine.decode(sequence))
+            stack_steps = count_steps(sequence)
+        except (KeyError, ValueError, IndexError):
+            # A program which fails when run, for example.
+            print "%-24s %10s" % (path, "invalid")
+            continue
+
+        register_steps = count_register_steps(code, names)
+        repeat = max(1, iterations / stack_steps)
+
+        create_stack = decoded_machine(sequence, image)
+        create_register = lambda: pl0_register_machine.RegisterMachine(code, names)
+
+        # A machine which computes the wrong result isn't timed, since its speedup would mean nothing.
+        if capture_output(pl0_machine.Machine.run_fast, create_stack()) != capture_output(pl0_register_machine.RegisterMachine.run, create_register()):
+            print "%-24s %10d %10d %7.2fx %8s %8s %8s  %s" % (path, stack_steps, register_steps,
+                float(stack_steps) / register_steps, '', '', '', "differs")
+            continue
+
+        baseline = measure(pl0_machine.Machine.run_fast, create_stack, repeat)
+        duration = measure(pl0_register_machine.RegisterMachine.run, create_register, repeat)
+
+        print "%-24s %10d %10d %7.2fx %7.3fs %7.3fs %7.2fx  %s" % (path, stack_steps, register_steps,
+            float(stack_steps) / register_steps, baseline, duration, baseline / max(duration, 1e-9), "same")
+
+def benchmark_pool(path, iterations):
+    processes = pl0_pool.multiprocessing.cpu_count()
+    steps = count_steps(assemble_source(open(path).read()))
+    jobs = max(processes * 8, iterations / steps)
+
+    print "Pool: %s, %d steps per job, %d jobs" % (path, steps, jobs)
+
+    # Aggregate throughput should scale with the number of processes.
+    for count in sorted(set([1, processes])):
+        start = time.time()
+        results = list(pl0_pool.run_jobs([path] * jobs, count))
+        print pl0_pool.summary(results, time.time() - start, count)
+
+def benchmark_output(path, iterations):
+    # The path is ignored, since the program must print a given number of values.
+    count = max(1, iterations / 2)
+    source = "var i; begin i := 0; while i < %d do begin i := i + 1; ! i end end."
+
+    sequence = assemble_source(source % count)
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    print "Output: printing %d values" % count
+
+    null = open(os.devnull, 'w')
+    try:
+        def create(output):
+            def create():
+                machine = pl0_machine.Machine(sequence, output())
+                machine.load(image)
+                return machine
+            return create
+
+        # Writing each value as soon as it is printed, as the print statement did.
+        unbuffered = lambda: pl0_output.Output(null, 1)
+        buffered = lambda: pl0_output.Output(null)
+
+        for run in (pl0_machine.Machine.run_fast, pl0_machine.Machine.run_compiled):
+            name = run.__name__
+
+            baseline = measure(run, create(unbuffered), 1)
+            report(name, count, baseline, unit = 'values')
+
+            duration = measure(run, create(buffered), 1)
+            report("buffered", count, duration, baseline, unit = 'values')
+
+            duration = measure(run, create(pl0_output.CaptureOutput), 1)
+            report("captured", count, duration, baseline, unit = 'values')
+
+        # The interpreter is much slower, so it prints fewer values.
+        parser = pl0_parser.Parser()
+        parser.input(source % (count / 20))
+        program = parser.p_program()
+
+        def interpret(output):
+            start = time.time()
+            pl0_interpreter.Interpreter(output).evaluate(program)
+            return time.time() - start
+
+        baseline = interpret(unbuffered())
+        report("interpreter", count / 20, baseline, unit = 'values')
+
+        duration = interpret(buffered())
+        report("buffered", count / 20, duration, baseline, unit = 'values')
+    finally:
+        null.close()
+
+def benchmark_interpreter(path, iterations):
+    # The path is ignored, the loop is scaled to the requested number of iterations.
+    count = max(1, iterations / 100)
+    source = "var i, s; begin i := 0; s := 0; while i < %d do begin i := i + 1; s := s + i * 2 end end."
+
+    parser = pl0_parser.Parser()
+    parser.input(source % count)
+    program = parser.p_program()
+
+    print "Interpreter: running %d loop iterations" % count
+
+    start = time.time()
+    pl0_interpreter.Interpreter().evaluate(program)
+    baseline = time.time() - start
+    report("interpreter", count, baseline, unit = 'loops')
+
+    start = time.time()
+    resolved = pl0_resolver.Resolver().resolve(program)
+    pl0_interpreter.ResolvedInterpreter().evaluate(resolved)
+    duration = time.time() - start
+    report("resolved", count, duration, baseline, unit = 'loops')
+
+    start = time.time()
+    pl0_interpreter.IterativeInterpreter().evaluate(resolved)
+    duration = time.time() - start
+    report("iterative", count, duration, baseline, unit = 'loops')
+
+    start = time.time()
+    run = pl0_closure_compiler.ClosureCompiler().compile(program)
+    run()
+    duration = time.time() - start
+    report("closures", count, duration, baseline, unit = 'loops')
+
+def benchmark_recursion(path, iterations):
+    # The path is ignored, the recursion is scaled to the requested depth.
+    depth = max(1, iterations / 20)
+    sources = [
+        ("tail", "var n; procedure r; begin if n > 0 then begin n := n - 1; call r end end; begin n := %d; call r end."),
+        ("nested", "var n, s; procedure r; begin if n > 0 then begin n := n - 1; call r; s := s + 1 end end; begin n := %d; call r end."),
+    ]
+
+    print "Recursion: %d calls deep" % depth
+
+    for name, source in sources:
+        parser = pl0_parser.Parser()
+        parser.input(source % depth)
+        program = pl0_resolver.Resolver().resolve(parser.p_program())
+
+        # The recursive interpreter uses several Python frames for each call.
+        try:
+            start = time.time()
+            pl0_interpreter.ResolvedInterpreter().evaluate(program)
+            baseline = time.time() - start
+            report("resolved", depth, baseline, unit = 'calls')
+        except RuntimeError, error:
+            baseline = None
+            print "%-12s %s" % ("resolved", error)
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        pl0_interpreter.IterativeInterpreter().evaluate(program)
+        duration = time.time() - start
+        report(name, depth, duration, baseline, unit = 'calls')
+
+        growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+        print "%-12s %10d KB peak memory growth" % ("", growth)
+
+def benchmark_memoize(path, iterations):
+    # The iterations are ignored, since naive recursion takes exponential time.
+    if path is None:
+        path = 'examples/recursive.pl0'
+
+    parser = pl0_parser.Parser()
+    parser.input(open(path).read())
+    program = pl0_resolver.Resolver().resolve(parser.p_program())
+    summaries = pl0_effects.Analyzer().analyze(program)
+
+    null = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        pl0_interpreter.ResolvedInterpreter(pl0_output.Output(null)).evaluate(program)
+        baseline = time.time() - start
+        report("resolved", 1, baseline, unit = 'runs')
+
+        for size in (2, pl0_interpreter.CallCache.SIZE):
+            interpreter = pl0_interpreter.MemoizingInterpreter(summaries, pl0_output.Output(null), size)
+
+            start = time.time()
+            interpreter.evaluate(program)
+            duration = time.time() - start
+            report("memoized", 1, duration, baseline, unit = 'runs')
+            print "%-12s %s" % (size, interpreter.cache.statistics())
+    finally:
+        null.close()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def benchmark_cooperative(path, iterations):
+    # One long-running program is started ahead of many short ones.
+    count = max(1, iterations / 100)
+    shorts = 100
+
+    def parse(source):
+        parser = pl0_parser.Parser()
+        parser.input(source)
+        return parser.p_program()
+
+    loop = "var i; begin i := 0; while i < %d do i := i + 1 end."
+    sources = [loop % count] + [loop % 100] * shorts
+
+    print "Cooperative: 1 program of %d iterations before %d of 100" % (count, shorts)
+
+    # Each program run to completion in turn.
+    programs = [pl0_resolver.Resolver().resolve(parse(source)) for source in sources]
+
+    start = time.time()
+    latencies = []
+    for program in programs:
+        pl0_interpreter.IterativeInterpreter().evaluate(program)
+        latencies.append(time.time() - start)
+
+    duration = time.time() - start
+    print "%-12s %8.3fs total, short programs p50 %8.3fs p99 %8.3fs" % ("sequential", duration, percentile(latencies[1:], 0.5), percentile(latencies[1:], 0.99))
+
+    for slice in (0.001, 0.01):
+        scheduler = pl0_scheduler.Scheduler(slice = slice)
+        tasks = [scheduler.spawn_program(parse(source)) for source in sources]
+
+        start = time.time()
+        scheduler.run()
+        duration = time.time() - start
+
+        # From the start of the run, rather than when each was spawned.
+        latencies = [task.completed - start for task in tasks[1:]]
+        print "%-12s %8.3fs total, short programs p50 %8.3fs p99 %8.3fs, longest slice %.4fs" % ("slice %g" % slice, duration, percentile(latencies, 0.5), percentile(latencies, 0.99), scheduler.statistics()['longest_slice'])
+
+def benchmark_budget(path, iterations):
+    sequence = assemble_source(open(path).read())
+    image = pl0_machine.fuse(pl0_machine.decode(sequence))
+
+    steps = count_dispatches(sequence, image)
+    repeat = max(1, iterations / steps)
+    total = steps * repeat
+
+    print "Budget: %s, %d dispatches per run, %d runs" % (path, steps, repeat)
+
+    # Generous enough that no limit is reached.
+    budget = lambda: pl0_budget.Budget(steps = 10 ** 9, seconds = 3600, depth = 10 ** 6)
+
+    baseline = measure(pl0_machine.Machine.run_fast, decoded_machine(sequence, image), repeat)
+    report("run_fast", total, baseline)
+
+    duration = measure(lambda machine: machine.run_budgeted(budget()), decoded_machine(sequence, image), repeat)
+    report("budgeted", total, duration, baseline)
+
+    # The interpreter is much slower, so it runs the program fewer times.
+    parser = pl0_parser.Parser()
+    parser.input(open(path).read())
+    program = parser.p_program()
+    runs = max(1, repeat / 20)
+
+    def interpret(budget):
+        return lambda interpreter: pl0_interpreter.Interpreter(interpreter, budget and budget()).evaluate(program)
+
+    baseline = measure(interpret(None), pl0_output.CaptureOutput, runs)
+    report("interpreter", runs, baseline, unit = 'runs')
+
+    duration = measure(interpret(budget), pl0_output.CaptureOutput, runs)
+    report("budgeted", runs, duration, baseline, unit = 'runs')
+
+def synthetic_source(count):
+    # A program with count procedures, each of a few statements, which are all called.
+    lines = ["var x, y;"]
+
+    for i in xrange(count):
+        lines.append("procedure p%d; var a; begin a := x + %d; if a > y then y := a * 2; while a < 10 do a := a + 1 end;" % (i, i))
+
+    lines.append("begin")
+    lines.append(";\n".join("  call p%d" % i for i in xrange(count)))
+    lines.append("end.")
+
+    return "\n".join(lines)
+
+def benchmark_pipeline(path, iterations):
+    # The path is ignored, the program is generated with iterations / 1000 procedures.
+    count = max(1, iterations / 1000)
+    source = synthetic_source(count)
+
+    print "Pipeline: %d procedures, %d lines" % (count, source.count("\n") + 1)
+
+    # Assembly text and a repr'd sequence, as between the command line tools.
+    start = time.time()
+    text = "\n".join(compile_source(source))
+    sequence = ast.literal_eval(`pl0_assembler.assemble(text.splitlines())`)
+    baseline = time.time() - start
+    report("text", len(sequence), baseline, unit = 'words')
+
+    start = time.time()
+    result = pl0_compiler.compile_source(source)
+    duration = time.time() - start
+    report("in-process", len(result), duration, baseline, unit = 'words')
+
+    assert result == sequence
+
+def benchmark_optimizer(path, iterations):
+    if path is None:
+        path = 'examples/arithmetic.pl0'
+
+    source = open(path).read()
+    sequence = pl0_compiler.compile_source(source)
+    optimized = pl0_compiler.compile_source(source, optimize = True)
+
+    steps = count_steps(sequence)
+    repeat = max(1, iterations / steps)
+
+    print "Optimizer: %s, %d steps per run, %d optimized, %d runs" % (path, steps, count_steps(optimized), repeat)
+
+    baseline = measure(pl0_machine.Machine.run, reference_machine(sequence), repeat)
+    report("machine", repeat, baseline, unit = 'runs')
+
+    duration = measure(pl0_machine.Machine.run, reference_machine(optimized), repeat)
+    report("optimized", repeat, duration, baseline, unit = 'runs')
+
+    # The interpreter is much slower, so it runs the program fewer times.
+    parser = pl0_parser.Parser()
+    parser.input(source)
+    program = parser.p_program()
+    runs = max(1, repeat / 20)
+
+    def interpret(program):
+        return lambda output: pl0_interpreter.Interpreter(output).evaluate(program)
+
+    baseline = measure(interpret(program), pl0_output.CaptureOutput, runs)
+    report("interpreter", runs, baseline, unit = 'runs')
+
+    duration = measure(interpret(pl0_optimizer.Optimizer(dynamic = True).optimize(program)), pl0_output.CaptureOutput, runs)
+    report("optimized", runs, duration, baseline, unit = 'runs')
+
+BENCHMARKS = {
+    'dispatch': benchmark_dispatch,
+    'fusion': benchmark_fusion,
+    'compiled': benchmark_compiled,
+    'traced': benchmark_traced,
+    'batch': benchmark_batch,
+    'fixed': benchmark_fixed,
+    'load': benchmark_load,
+    'profile': benchmark_profile,
+    'registers': benchmark_registers,
+    'pool': benchmark_pool,
+    'output': benchmark_output,
+    'interpreter': benchmark_interpreter,
+    'recursion': benchmark_recursion,
+    'memoize': benchmark_memoize,
+    'cooperative': benchmark_cooperative,
+    'budget': benchmark_budget,
+    'pipeline': benchmark_pipeline,
+    'optimizer': benchmark_optimizer,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'PL/0 virtual machine benchmarks')
+    parser.add_argument('benchmark', choices = sorted(BENCHMARKS))
+    parser.add_argument('path', nargs = '?')
+    parser.add_argument('-n', '--iterations', type = int, default = 2000000)
+    arguments = parser.parse_args()
+
+    # The registers benchmark runs all of tests/ and examples/ by default,
+    # the memoize benchmark runs examples/recursive.pl0 and the optimizer
+    # benchmark runs examples/arithmetic.pl0.
+    path = arguments.path
+    if path is None and arguments.benchmark not in ('registers', 'memoize', 'optimizer'):
+        path = 'examples/fibonacci.pl0'
+
+    BENCHMARKS[arguments.benchmark](path, arguments.iterations)
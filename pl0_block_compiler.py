@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import ast
+import hashlib
+import collections
+import pl0_machine
+from pl0_machine import *
+
+# Conditional jumps, as a test on the value popped from the stack.
+BRANCHES = {
+    JLT: '%s > 0',
+    JLTE: '%s >= 0',
+    JE: '%s == 0',
+    JNE: '%s != 0',
+    JGTE: '%s <= 0',
+    JGT: '%s < 0',
+}
+
+COMPARISON_OPERATORS = {
+    CMPLT: '<',
+    CMPLTE: '<=',
+    CMPE: '==',
+    CMPNE: '!=',
+    CMPGTE: '>=',
+    CMPGT: '>',
+}
+
+# Instructions which always transfer control and so end a basic block.
+TERMINATORS = JUMP_OPERANDS + (HALT, RET, JCMPVK)
+
+# Compiled programs, keyed by a hash of the image code, least recently used first.
+CACHE = collections.OrderedDict()
+CACHE_SIZE = 64
+
+def leaders(image):
+    # The first instruction of every basic block.
+    result = set([0])
+
+    for i, (opcode, operand) in enumerate(image.code):
+        if opcode in JUMP_OPERANDS:
+            result.add(operand)
+            result.add(i + 1)
+        elif opcode == JCMPVK:
+            result.add(operand[3])
+            result.add(i + 1)
+        elif opcode in (HALT, RET):
+            result.add(i + 1)
+
+    return sorted(x for x in result if x < len(image.code))
+
+class Translator:
+    """
+    Translates a decoded image into the source of a single Python function.
+    Each basic block keeps the operand stack as expressions and temporaries
+    in locals, and only spills to the real stack when control leaves the
+    block. Variables are held in locals for the whole run. Blocks are
+    selected by a binary search on the instruction index, which acts as
+    the trampoline between them.
+
+    With a depth, the code is for a FixedMachine with a stack of that
+    depth: arithmetic wraps around like it does, and StackOverflowError
+    is raised when a block is entered with more values on the stack.
+    """
+
+    def __init__(self, image, depth = None):
+        self.image = image
+        self.depth = depth
+        self.lines = []
+        self.values = []
+        self.temporaries = 0
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def temporary(self):
+        self.temporaries += 1
+        return 't%d' % self.temporaries
+
+    # Each value on the symbolic stack is a pair of (expression, variables it reads).
+    def push(self, expression, variables = frozenset()):
+        self.values.append((expression, variables))
+
+    def pop(self):
+        if self.values:
+            return self.values.pop()
+
+        # The value was pushed by a previous block.
+        name = self.temporary()
+        self.emit("%s = pop()" % name)
+        return (name, frozenset())
+
+    def materialize(self, value):
+        expression, variables = value
+
+        if expression.isalnum() or expression.lstrip('-').isdigit():
+            return value
+
+        name = self.temporary()
+        self.emit("%s = %s" % (name, expression))
+        return (name, frozenset())
+
+    def spill(self, variable):
+        # Pending values must observe the variable before it is assigned.
+        for i, (expression, variables) in enumerate(self.values):
+            if variable in variables:
+                name = self.temporary()
+                self.emit("%s = %s" % (name, expression))
+                self.values[i] = (name, frozenset())
+
+    def flush(self):
+        for expression, variables in self.values:
+            self.emit("append(%s)" % expression)
+
+        self.values = []
+
+    def jump(self, target):
+        self.emit("pc = %d" % target)
+        self.emit("continue")
+
+    def translate_block(self, start, end):
+        self.lines = []
+        self.values = []
+
+        for i in xrange(start, end):
+            opcode, operand = self.image.code[i]
+
+            method = getattr(self, "translate_%s" % NAMES[opcode].lower())
+            method(operand, i)
+
+        # Fall through into the next block.
+        if opcode not in TERMINATORS:
+            self.flush()
+            self.jump(end)
+
+        return self.lines
+
+    def translate_nop(self, operand, i):
+        pass
+
+    def translate_halt(self, operand, i):
+        self.flush()
+
+        # The trailing HALT stands for running off the end of the sequence.
+        if i == len(self.image.code) - 1:
+            self.emit("return %d" % i)
+        else:
+            self.emit("return -1")
+
+    def translate_load(self, address, i):
+        self.push('v%d' % address, frozenset([address]))
+
+    def translate_save(self, address, i):
+        expression, variables = self.pop()
+        self.spill(address)
+        self.emit("v%d = %s" % (address, expression))
+
+    def wrap(self, expression):
+        if self.depth is None:
+            return expression
+
+        return "wrap%s" % expression
+
+    def translate_push(self, value, i):
+        self.push(repr(value if self.depth is None else wrap(value)))
+
+    def translate_pop(self, operand, i):
+        self.pop()
+
+    def translate_dup(self, operand, i):
+        value = self.materialize(self.pop())
+        self.values += [value, value]
+
+    def translate_jmp(self, address, i):
+        self.flush()
+        self.jump(address)
+
+    def translate_call(self, address, i):
+        self.flush()
+        self.emit("append(%d)" % self.image.addresses[i + 1])
+        self.jump(address)
+
+    def translate_ret(self, operand, i):
+        self.flush()
+        self.emit("pc = index[pop()]")
+        self.emit("continue")
+
+    def translate_enter(self, operand, i):
+        self.emit("enter(%d, %d)" % operand)
+
+    def translate_leave(self, operand, i):
+        self.emit("leave()")
+
+    def local(self, depth, slot):
+        if depth:
+            return "memory[frames.address(%d, %d)]" % (depth, slot)
+        else:
+            return "memory[frames.fp + %d]" % (slot + 2)
+
+    def translate_loadl(self, operand, i):
+        # Locals are read at once, so later stores and calls can't change the value.
+        name = self.temporary()
+        self.emit("%s = %s" % (name, self.local(*operand)))
+        self.push(name)
+
+    def translate_savel(self, operand, i):
+        expression, variables = self.pop()
+        self.emit("%s = %s" % (self.local(*operand), expression))
+
+    def branch(self, condition, address, i):
+        self.flush()
+        self.emit("if %s:" % condition)
+        self.emit("    pc = %d" % address)
+        self.emit("else:")
+        self.emit("    pc = %d" % (i + 1))
+        self.emit("continue")
+
+    def translate_conditional(self, address, i):
+        opcode = self.image.code[i][0]
+        expression, variables = self.pop()
+        self.branch(BRANCHES[opcode] % expression, address, i)
+
+    translate_jlt = translate_jlte = translate_je = translate_conditional
+    translate_jne = translate_jgte = translate_jgt = translate_conditional
+
+    def translate_comparison(self, operand, i):
+        opcode = self.image.code[i][0]
+        b, a = self.pop(), self.pop()
+        self.push("int(%s %s %s)" % (a[0], COMPARISON_OPERATORS[opcode], b[0]), a[1] | b[1])
+
+    translate_cmplt = translate_cmplte = translate_cmpe = translate_comparison
+    translate_cmpne = translate_cmpgte = translate_cmpgt = translate_comparison
+
+    def arithmetic(self, operator):
+        # Mirrors Machine, which combines the top of the stack with the value below it.
+        b, a = self.pop(), self.pop()
+        self.push(self.wrap("(%s %s %s)" % (b[0], operator, a[0])), a[1] | b[1])
+
+    def translate_mul(self, operand, i):
+        self.arithmetic('*')
+
+    def translate_div(self, operand, i):
+        # Division can fail, so it is evaluated in program order.
+        self.arithmetic('/')
+        self.values.append(self.materialize(self.values.pop()))
+
+    def translate_add(self, operand, i):
+        self.arithmetic('+')
+
+    def translate_sub(self, operand, i):
+        self.arithmetic('-')
+
+    def translate_print(self, operand, i):
+        value = self.materialize(self.pop())
+        self.emit("write(%s)" % value[0])
+        self.values.append(value)
+
+    def translate_debug(self, operand, i):
+        self.flush()
+        self.emit("data[:] = [%s]" % self.variables())
+        self.emit("debug(%d)" % self.image.addresses[i + 1])
+
+    def translate_mark(self, operand, i):
+        pass
+
+    def translate_addvv(self, operand, i):
+        a, b = operand
+        self.push(self.wrap("(v%d + v%d)" % (b, a)), frozenset([a, b]))
+
+    def translate_jcmpvk(self, operand, i):
+        x, k, comparison, address = operand
+        self.branch("not v%d %s %r" % (x, COMPARISON_OPERATORS[comparison], k), address, i)
+
+    def translate_savek(self, operand, i):
+        k, x = operand
+        self.spill(x)
+        self.emit("v%d = %r" % (x, k if self.depth is None else wrap(k)))
+
+    def translate_printpop(self, operand, i):
+        self.emit("write(%s)" % self.pop()[0])
+
+    def prologue(self):
+        return [
+            "    append = stack.append",
+            "    pop = stack.pop",
+            "    memory = frames.memory",
+            "    enter = frames.enter",
+            "    leave = frames.leave",
+        ]
+
+    def check(self):
+        # The stack grows by a bounded amount within a block, so its depth is checked between them.
+        if self.depth is None:
+            return []
+
+        return [
+            "if len(stack) > %d:" % self.depth,
+            "    raise StackOverflowError('Stack depth of %d exceeded')" % self.depth,
+        ]
+
+    def variables(self):
+        return ", ".join('v%d' % x for x in xrange(len(self.image.data)))
+
+    def trampoline(self, blocks, depth):
+        indent = "    " * depth
+
+        if len(blocks) == 1:
+            start, lines = blocks[0]
+            self.source.append(indent + "if pc == %d:" % start)
+            self.source.extend(indent + "    " + line for line in lines)
+            return
+
+        middle = len(blocks) / 2
+        self.source.append(indent + "if pc < %d:" % blocks[middle][0])
+        self.trampoline(blocks[:middle], depth + 1)
+        self.source.append(indent + "else:")
+        self.trampoline(blocks[middle:], depth + 1)
+
+    def translate(self):
+        starts = leaders(self.image)
+        ends = starts[1:] + [len(self.image.code)]
+        blocks = [(start, self.translate_block(start, end)) for start, end in zip(starts, ends)]
+
+        self.source = [
+            "def program(data, stack, pc, debug, frames, write):",
+        ] + self.prologue()
+
+        if self.image.data:
+            self.source.append("    %s, = data" % self.variables())
+
+        self.source += [
+            "    try:",
+            "        while True:",
+        ]
+
+        self.source.extend("            " + line for line in self.check())
+        self.trampoline(blocks, 3)
+        self.source.append("            raise ValueError('Invalid jump to instruction %d' % pc)")
+
+        self.source += [
+            "    finally:",
+            "        data[:] = [%s]" % self.variables(),
+        ]
+
+        return "\n".join(self.source) + "\n"
+
+def program_key(image):
+    return hashlib.sha1(repr((image.code, image.addresses))).hexdigest()
+
+def compile_image(image, depth = None):
+    # See Translator for the depth.
+    key = program_key(image)
+
+    if depth is not None:
+        key += ":%d" % depth
+
+    if key in CACHE:
+        program = CACHE.pop(key)
+    else:
+        source = Translator(image, depth).translate()
+
+        namespace = {'index': image.index, 'wrap': wrap, 'StackOverflowError': StackOverflowError}
+        exec compile(source, "<pl0:%s>" % key, 'exec') in namespace
+
+        program = namespace['program']
+
+        if len(CACHE) >= CACHE_SIZE:
+            CACHE.popitem(last = False)
+
+    CACHE[key] = program
+
+    return program
+
+if __name__ == '__main__':
+    buffer = sys.stdin.read()
+    code = ast.literal_eval(buffer)
+    print Translator(pl0_machine.fuse(pl0_machine.decode(code))).translate()
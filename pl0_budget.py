@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Limits on the resources used by untrusted programs. Engines call
+# Budget.check() only at loop back-edges and calls, since a program can only
+# run for an unbounded time, or grow its stack without bound, through those.
+
+import time
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a program exceeds its budget. The output is the engine's
+    output, which has been flushed, so a pl0_output.CaptureOutput holds the
+    values printed so far. The statistics are those of Budget.statistics().
+    """
+
+    def __init__(self, message, output, statistics):
+        Exception.__init__(self, message)
+
+        self.output = output
+        self.statistics = statistics
+
+class StepLimitExceeded(BudgetExceeded):
+    pass
+
+class DeadlineExceeded(BudgetExceeded):
+    pass
+
+class DepthLimitExceeded(BudgetExceeded):
+    pass
+
+class Budget:
+    """
+    A step budget, counted in back-edges and calls, a wall clock deadline
+    in seconds from start(), and a ceiling on the depth of the engine's
+    stack, as given by its stack_depth() method. Any of these may be None.
+    The clock is only read every INTERVAL checks, so a deadline may be
+    overrun by the time that many loop iterations or calls take.
+    """
+
+    INTERVAL = 64
+
+    def __init__(self, steps = None, seconds = None, depth = None):
+        self.steps = steps
+        self.seconds = seconds
+        self.depth = depth
+
+        self.used = 0
+        self.started = None
+        self.deadline = None
+
+        # The step at which the step limit and the deadline are next checked.
+        self.next = 0
+
+    def start(self):
+        self.used = 0
+        self.next = 0
+        self.started = time.time()
+
+        if self.seconds is not None:
+            self.deadline = self.started + self.seconds
+
+    def statistics(self, engine):
+        return {
+            'steps': self.used,
+            'elapsed': time.time() - self.started,
+            'depth': engine.stack_depth(),
+        }
+
+    def exceeded(self, exception_class, message, engine):
+        engine.output.flush()
+        return exception_class(message, engine.output, self.statistics(engine))
+
+    def check(self, engine):
+        self.used += 1
+
+        if self.used >= self.next:
+            self.check_limits(engine)
+
+        if self.depth is not None and engine.stack_depth() > self.depth:
+            raise self.exceeded(DepthLimitExceeded, "Depth limit of %d exceeded" % self.depth, engine)
+
+    def check_limits(self, engine):
+        if self.steps is not None and self.used > self.steps:
+            raise self.exceeded(StepLimitExceeded, "Step limit of %d exceeded" % self.steps, engine)
+
+        if self.deadline is not None and time.time() > self.deadline:
+            raise self.exceeded(DeadlineExceeded, "Deadline of %gs exceeded" % self.seconds, engine)
+
+        self.next = self.used + self.INTERVAL
+
+        if self.steps is not None:
+            self.next = min(self.next, self.steps + 1)
+
+def parse_arguments(arguments):
+    # A budget from --steps=N, --seconds=S and --depth=N, or None if none are given.
+    limits = {}
+
+    for argument in arguments:
+        for name, convert in (('steps', int), ('seconds', float), ('depth', int)):
+            if argument.startswith('--%s=' % name):
+                limits[name] = convert(argument.split('=', 1)[1])
+
+    if limits:
+        return Budget(**limits)
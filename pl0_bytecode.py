@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Binary images of decoded programs. All integers are little-endian, and
+# every section is a multiple of 8 bytes long so that the 64-bit sections
+# stay aligned:
+#
+#   header    = magic "PL0B", version (u16), flags (u16, see FRAMES),
+#               instruction count (u64), data count (u64), symbol table size (u64)
+#   code      = (opcode, operand) pairs of i64, one per instruction
+#   frames    = if FRAMES is set, a count (i64) followed by an (index, depth,
+#               slot) triple of i64 for each instruction with two operands
+#   addresses = the sequence offset of each instruction, i64
+#   data      = the initial value of each data slot, i64
+#   variables = the sequence offset of each data slot, i64
+#   symbols   = optional "label offset" lines, padded with newlines
+#
+# Sections are mapped into memory and viewed as arrays of 64-bit integers
+# in place, so nothing is parsed element by element. Building the list of
+# instructions still creates a tuple for each one, but in C rather than in
+# a Python loop.
+
+import os
+import sys
+import mmap
+import ctypes
+import struct
+import pl0_machine
+
+MAGIC = 'PL0B'
+VERSION = 2
+
+# Set if the code uses activation records, whose instructions have two
+# operands. These are stored pre-split in the frames section, so that only
+# those instructions need to be patched when loading.
+FRAMES = 1
+
+HEADER = struct.Struct('<4sHHQQQ')
+WORD = struct.Struct('<q')
+
+class FormatError(Exception):
+    pass
+
+def padding(size):
+    return -size % WORD.size
+
+def write_words(stream, words):
+    stream.write(struct.pack('<%dq' % len(words), *words))
+
+def write_image(stream, image):
+    if image.fusions:
+        raise ValueError("Superinstructions can't be written, write the image before fuse()")
+
+    symbols = ''.join("%s %d\n" % item for item in sorted(image.symbols.items()))
+    symbols += "\n" * padding(len(symbols))
+
+    flags = 0
+    code = []
+    frames = []
+
+    for i, (opcode, operand) in enumerate(image.code):
+        if opcode in pl0_machine.FRAME_OPERANDS:
+            flags |= FRAMES
+            frames += [i, operand[0], operand[1]]
+            operand = 0
+
+        code += [opcode, operand or 0]
+
+    stream.write(HEADER.pack(MAGIC, VERSION, flags, len(image.code), len(image.data), len(symbols)))
+
+    write_words(stream, code)
+
+    if flags & FRAMES:
+        write_words(stream, [len(frames) // 3] + frames)
+
+    write_words(stream, image.addresses)
+    write_words(stream, image.data)
+    write_words(stream, image.variables)
+
+    stream.write(symbols)
+
+def view(buffer, offset, count):
+    # A zero-copy array over the buffer, which must be writable.
+    return (ctypes.c_int64 * count).from_buffer(buffer, offset)
+
+def read_image(buffer):
+    if len(buffer) < HEADER.size:
+        raise FormatError("Truncated header")
+
+    magic, version, flags, instructions, slots, symbols_size = HEADER.unpack_from(buffer, 0)
+
+    if magic != MAGIC:
+        raise FormatError("Not a PL/0 binary image")
+
+    if version != VERSION:
+        raise FormatError("Unsupported image version %d" % version)
+
+    offset = HEADER.size
+    size = offset + WORD.size * (instructions * 3 + slots * 2) + symbols_size
+
+    if len(buffer) < size:
+        raise FormatError("Truncated image")
+
+    code = view(buffer, offset, instructions * 2)
+    offset += WORD.size * instructions * 2
+
+    frames = []
+    if flags & FRAMES:
+        if len(buffer) < size + WORD.size:
+            raise FormatError("Truncated image")
+
+        count, = WORD.unpack_from(buffer, offset)
+        offset += WORD.size
+        size += WORD.size * (1 + count * 3)
+
+        if count < 0 or len(buffer) < size:
+            raise FormatError("Truncated image")
+
+        frames = view(buffer, offset, count * 3)
+        offset += WORD.size * count * 3
+
+    addresses = view(buffer, offset, instructions)
+    offset += WORD.size * instructions
+
+    data = view(buffer, offset, slots)
+    offset += WORD.size * slots
+
+    variables = view(buffer, offset, slots)
+    offset += WORD.size * slots
+
+    symbols = {}
+    for line in buffer[offset:offset + symbols_size].splitlines():
+        if line:
+            name, address = line.split()
+            symbols[name] = int(address)
+
+    # Slicing the views builds the lists in C, without parsing.
+    instructions = zip(code[0::2], code[1::2])
+
+    for i, depth, slot in zip(frames[0::3], frames[1::3], frames[2::3]):
+        if not 0 <= i < len(instructions):
+            raise FormatError("Invalid frame instruction %d" % i)
+
+        instructions[i] = (instructions[i][0], (depth, slot))
+
+    return pl0_machine.Image(instructions, data[:], addresses[:], variables[:], symbols = symbols)
+
+def load_image(path):
+    with open(path, 'rb') as file:
+        # An empty file can't be mapped at all.
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            raise FormatError("Truncated header")
+
+        # A private copy-on-write mapping, so the views can be created without copying the file.
+        buffer = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY)
+
+    return read_image(buffer)
+
+if __name__ == '__main__':
+    # Shows the contents of a binary image.
+    image = load_image(sys.argv[1])
+
+    for address, (opcode, operand) in zip(image.addresses, image.code):
+        print "%6d: %-8s %s" % (address, pl0_machine.NAMES[opcode], operand)
+
+    print "Data: " + `zip(image.variables, image.data)`
+    print "Symbols: " + `image.symbols`
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import pl0_parser
+import pl0_output
+import pl0_optimizer
+from pl0_node_visitor import NodeVisitor, Block
+
+# Comparisons understood by the interpreter, see Interpreter.accept_condition.
+COMPARISONS = {
+    'LT': lambda lhs, rhs: lambda: lhs() < rhs(),
+    'LTE': lambda lhs, rhs: lambda: lhs() <= rhs(),
+    'GT': lambda lhs, rhs: lambda: lhs() > rhs(),
+    'GTE': lambda lhs, rhs: lambda: lhs() >= rhs(),
+    'E': lambda lhs, rhs: lambda: lhs() == rhs(),
+    'NE': lambda lhs, rhs: lambda: lhs() != rhs(),
+}
+
+def undefined(name):
+    return NameError("Undefined name referenced: " + repr(name))
+
+def nothing():
+    pass
+
+class ClosureCompiler(NodeVisitor):
+    """
+    Converts the syntax tree, once, into nested Python closures which run
+    the program with the same behaviour as Interpreter. Names keep their
+    dynamic scoping by shallow binding: each name has a list of cells, one
+    for every active block which declares it, so a reference is resolved
+    at compile time to that list and reads the last cell when it runs.
+    Each cell is a [value, kind] pair.
+    """
+
+    def __init__(self, output = None):
+        # Where printed values are written, see pl0_output.
+        self.output = output or pl0_output.Output()
+        self.names = {}
+
+    def cells(self, name):
+        return self.names.setdefault(name, [])
+
+    def compile(self, program):
+        return self.visit_node(program)
+
+    def accept_program(self, nid, block):
+        body = self.visit_node(block)
+        output = self.output
+
+        def program(frame = None):
+            try:
+                body(frame)
+            finally:
+                output.flush()
+
+        return program
+
+    def accept_block(self, nid, constants, variables, procedures, statement):
+        # Within a block constants hide variables, which hide procedures.
+        visible = {}
+
+        for proc in (procedures or [])[1:]:
+            visible[proc[1]] = ('PROCEDURE', self.visit_node(proc[2]))
+
+        for var in (variables or [])[1:]:
+            visible[var[1]] = ('VARIABLE', 0)
+
+        for var in (constants or [])[1:]:
+            visible[var[1]] = ('CONSTANT', var[2])
+
+        declarations = [(self.cells(name), kind, value) for name, (kind, value) in visible.items()]
+        statement = self.visit_node(statement) or nothing
+
+        def block(frame = None):
+            for cells, kind, value in declarations:
+                cells.append([value, kind])
+
+            try:
+                statement()
+
+                if frame is not None:
+                    for name, (kind, value) in visible.items():
+                        value, kind = self.names[name][-1]
+
+                        if kind == 'CONSTANT':
+                            frame.define(name, value)
+                        elif kind == 'VARIABLE':
+                            frame.update(name, value)
+                        else:
+                            frame.declare(name, value)
+            finally:
+                for cells, kind, value in declarations:
+                    cells.pop()
+
+        return block
+
+    def accept_set(self, nid, target, expression):
+        name = target[1]
+        cells = self.cells(name)
+        expression = self.visit_node(expression)
+
+        def assign():
+            value = expression()
+
+            if not cells:
+                raise undefined(name)
+
+            cell = cells[-1]
+
+            # Assigning to a constant is hidden by the constant itself.
+            if cell[1] != 'CONSTANT':
+                cell[0] = value
+                cell[1] = 'VARIABLE'
+
+        return assign
+
+    def accept_call(self, nid, name):
+        cells = self.cells(name)
+
+        def call():
+            if not cells:
+                raise undefined(name)
+
+            value, kind = cells[-1]
+
+            if kind != 'PROCEDURE':
+                raise NameError("Expecting procedure but got: " + kind)
+
+            value()
+
+        return call
+
+    def accept_begin(self, *node):
+        statements = tuple(self.visit_node(statement) for statement in node[1:])
+
+        def begin():
+            for statement in statements:
+                statement()
+
+        return begin
+
+    def accept_while(self, nid, condition, body):
+        condition = self.visit_node(condition)
+        body = self.visit_node(body) or nothing
+
+        def loop():
+            while condition():
+                body()
+
+        return loop
+
+    def accept_if(self, nid, condition, body):
+        condition = self.visit_node(condition)
+        body = self.visit_node(body) or nothing
+
+        def branch():
+            if condition():
+                body()
+
+        return branch
+
+    def accept_print(self, nid, expression):
+        expression = self.visit_node(expression)
+        write = self.output.write
+
+        return lambda: write(repr(expression()))
+
+    def accept_odd(self, nid, expression):
+        expression = self.visit_node(expression)
+
+        return lambda: expression() % 2 != 0
+
+    def accept_condition(self, nid, lhs, operator, rhs):
+        lhs = self.visit_node(lhs)
+        rhs = self.visit_node(rhs)
+
+        if operator in COMPARISONS:
+            return COMPARISONS[operator](lhs, rhs)
+
+        def unknown():
+            lhs()
+            rhs()
+            raise ArithmeticError("Unknown comparison operator " + operator)
+
+        return unknown
+
+    def accept_expression(self, nid, sign, *terms):
+        total = self.visit_node(terms[0])
+
+        for operator, term in terms[1:]:
+            total = self.combine(operator, total, self.visit_node(term))
+
+        if sign == 'MINUS':
+            return self.combine('NEGATE', total, None)
+
+        return total
+
+    def accept_term(self, nid, *factors):
+        total = self.visit_node(factors[0])
+
+        for operator, factor in factors[1:]:
+            total = self.combine(operator, total, self.visit_node(factor))
+
+        return total
+
+    def combine(self, operator, lhs, rhs):
+        if operator == 'PLUS':
+            return lambda: lhs() + rhs()
+        if operator == 'MINUS':
+            return lambda: lhs() - rhs()
+        if operator == 'TIMES':
+            return lambda: lhs() * rhs()
+        if operator == 'DIVIDE':
+            return lambda: lhs() / rhs()
+        if operator == 'NEGATE':
+            return lambda: lhs() * -1
+
+        # Like Interpreter, other operators evaluate and ignore the rhs.
+        def ignore():
+            total = lhs()
+            rhs()
+            return total
+
+        return ignore
+
+    def accept_number(self, nid, value):
+        return lambda: value
+
+    def accept_name(self, nid, name):
+        cells = self.cells(name)
+
+        def load():
+            if not cells:
+                raise undefined(name)
+
+            return cells[-1][0]
+
+        return load
+
+if __name__ == '__main__':
+    code = sys.stdin.read()
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = parser.p_program()
+
+    if '--optimize' in sys.argv:
+        program = pl0_optimizer.Optimizer(dynamic = True).optimize(program)
+
+    result = Block()
+    ClosureCompiler().compile(program)(result)
+
+    result.debug()
@@ -25,14 +25,47 @@ import os
 import sys
 import StringIO
 import pl0_parser
+import pl0_assembler
+import pl0_optimizer
 from pl0_node_visitor import StackingNodeVisitor
 
+class TextEmitter:
+    """
+    Writes the instructions emitted by the compiler to stdout as assembly
+    text, for pl0_assembler.py. See pl0_assembler.Assembler, which takes
+    the same calls and builds the sequence directly.
+    """
+
+    def entry(self, name):
+        print "JMP " + name
+
+    def label(self, name):
+        print name + ":"
+
+    def data(self, value):
+        print "    " + str(value)
+
+    def comment(self, text):
+        print "# " + text
+
+    def instruction(self, name, *operands):
+        print "\t" + " ".join([name] + [str(operand) for operand in operands])
+
+# The instruction for each operator of a term or expression.
+ARITHMETIC = {'TIMES': "MUL", 'DIVIDE': "DIV", 'PLUS': "ADD", 'MINUS': "SUB"}
+
 class Compiler(StackingNodeVisitor):
 
-    def __init__(self):
+    def __init__(self, emitter = None):
         super(Compiler, self).__init__()
         self.label_id = 0
 
+        # Where instructions are written, as text by default.
+        self.emitter = emitter or TextEmitter()
+
+        # The number of locals of each procedure, by label.
+        self.frame_sizes = {}
+
     def intermediate_label(self, hint = ''):
         self.label_id += 1
         return 't_' + hint + '_' + `self.label_id`
@@ -41,8 +74,25 @@ class Compiler(StackingNodeVisitor):
         self.push()
         result = self.visit_node(node)
         return [self.pop(), result]
+
+    def emit(self, *instruction):
+        self.emitter.instruction(*instruction)
+
+    def label(self, name):
+        self.emitter.label(name)
+
+    def is_local(self, level):
+        # Everything but the outermost scope, which holds the globals.
+        return len(self.stack) + level > 0
 
     def accept_variables(self, *node):
+        if len(self.stack) > 1:
+            # Variables of procedures are locals, numbered within the activation record.
+            for var in node[1:]:
+                self.stack[-1].update(var[1], len(self.stack[-1].variables))
+
+            return
+
         for var in node[1:]:
             # Generate a unique name for the variable
             variable_name = self.intermediate_label('var_' + var[1])
@@ -51,8 +101,8 @@ class Compiler(StackingNodeVisitor):
             self.stack[-1].update(var[1], variable_name)
             
             # Allocate static storage space for the variable
-            print variable_name + ":"
-            print "    0"
+            self.label(variable_name)
+            self.emitter.data(0)
     
     def accept_constants(self, *node):
         for var in node[1:]:
@@ -69,27 +119,30 @@ class Compiler(StackingNodeVisitor):
             # Define a new lexical scope
             self.push()
 
-            # Generate any static storage required by the procedure
-            print "# Procedure " + proc[1]
-            self.visit_expressions(proc[2][1:3])
+            # Nested procedures may call this one, so its frame size is needed first
+            self.frame_sizes[proc_name] = len((proc[2][2] or [])[1:])
+
+            # Allocate locals, and generate any nested procedures
+            self.emitter.comment("Procedure " + proc[1])
+            self.visit_expressions(proc[2][1:4])
 
             # Generate the code for the procedure
-            print proc_name + ":"
+            self.label(proc_name)
             self.visit_node(proc[2][4])
-            print "\tRET"
+            self.emit("RET")
 
             # Finished with lexical scope
             self.pop()
 
     def accept_program(self, *node):
-        print "JMP main"
+        self.emitter.entry("main")
 
         block = node[1]
         self.visit_expressions(block[1:4])
 
-        print "main:"
+        self.label("main")
         self.visit_node(block[4])
-        print "\tHALT"
+        self.emit("HALT")
 
     def accept_while(self, *node):
         top_label = self.intermediate_label("while_start")
@@ -98,16 +151,16 @@ class Compiler(StackingNodeVisitor):
         condition = node[1]
         loop = node[2]
 
-        print top_label + ":"
+        self.label(top_label)
         # Result of condition is on top of stack
         self.visit_node(condition)
 
-        print "\tJE " + bottom_label
+        self.emit("JE", bottom_label)
 
         self.visit_node(loop)
 
-        print "\tJMP " + top_label
-        print bottom_label + ":"
+        self.emit("JMP", top_label)
+        self.label(bottom_label)
 
     def accept_if(self, *node):
         false_label = self.intermediate_label("if_false")
@@ -117,11 +170,11 @@ class Compiler(StackingNodeVisitor):
 
         self.visit_node(condition)
 
-        print "\tJE " + false_label
+        self.emit("JE", false_label)
 
         self.visit_node(body)
 
-        print false_label + ":"
+        self.label(false_label)
 
     def accept_condition(self, *node):
         operator = node[2]
@@ -131,7 +184,7 @@ class Compiler(StackingNodeVisitor):
         self.visit_node(lhs)
         self.visit_node(rhs)
 
-        print "\tCMP" + operator
+        self.emit("CMP" + operator)
 
     def accept_set(self, *node):
         name = node[1][1]
@@ -144,7 +197,10 @@ class Compiler(StackingNodeVisitor):
         if defined != 'VARIABLE':
             raise NameError("Invalid assignment to non-variable " + assign_to + " of type " + defined)
 
-        print "\tSAVE " + value
+        if self.is_local(level):
+            self.emit("SAVEL", -level - 1, value)
+        else:
+            self.emit("SAVE", value)
 
     def accept_call(self, *node):
         defined, value, level = self.find(node[1])
@@ -152,58 +208,320 @@ class Compiler(StackingNodeVisitor):
         if defined != 'PROCEDURE':
             raise NameError("Expecting procedure but got: " + defined)
 
-        print "\tCALL " + value
+        # The activation record is linked to the record of the scope which declared the procedure.
+        self.emit("ENTER", -level - 1, self.frame_sizes[value])
+        self.emit("CALL", value)
+        self.emit("LEAVE")
+
+    def accept_odd(self, *node):
+        # There is no instruction for it, so compare the value with value / 2 * 2.
+        self.emit("PUSH", 2)
+        self.visit_node(node[1])
+        self.emit("DIV")
+        self.emit("PUSH", 2)
+        self.emit("MUL")
+        self.visit_node(node[1])
+        self.emit("CMPNE")
+
+    def arithmetic(self, first, operations):
+        # DIV and SUB combine the top of the stack with the value below it, so
+        # their right operand is pushed first, before the operations to its left.
+        if not operations:
+            self.visit_node(first)
+            return
+
+        operation, operand = operations[-1]
+
+        if operation in ('DIVIDE', 'MINUS'):
+            self.visit_node(operand)
+            self.arithmetic(first, operations[:-1])
+        else:
+            self.arithmetic(first, operations[:-1])
+            self.visit_node(operand)
+
+        self.emit(ARITHMETIC[operation])
 
     def accept_term(self, *node):
+        self.arithmetic(node[1], node[2:])
+
+    def accept_expression(self, *node):
+        # Result of this expression will be on the top of stack
+        self.arithmetic(node[2], node[3:])
+
+        if node[1] == 'MINUS':
+            self.emit("PUSH", -1)
+            self.emit("MUL")
+
+    def accept_print(self, *node):
         self.visit_node(node[1])
+        self.emit("PRINT")
+        self.emit("POP")
+
+    def accept_number(self, *node):
+        self.emit("PUSH", node[1])
+
+    def accept_name(self, *node):
+        defined, value, level = self.find(node[1])
+
+        if defined == 'VARIABLE' and self.is_local(level):
+            self.emit("LOADL", -level - 1, value)
+        elif defined == 'VARIABLE':
+            self.emit("LOAD", value)
+        elif defined == 'CONSTANT':
+            self.emit("PUSH", value)
+        else:
+            raise NameError("Invalid value name " + node[1] + " of type " + defined)
+
+
+class RegisterCompiler(Compiler):
+    """
+    Generates three-address code for pl0_register_machine. Every variable has
+    a register of its own, and intermediate results are kept in temporary
+    registers (%0, %1, ...) which are allocated in stack order and are free
+    again at the end of each statement. A procedure saves the registers of
+    its locals when it is entered and restores them when it returns, so
+    each activation has its own locals, starting at zero as in Machine.
+    """
+
+    # The jump taken when a comparison is false.
+    INVERSE = {'LT': 'JGTE', 'LTE': 'JGT', 'GT': 'JLTE', 'GTE': 'JLT', 'E': 'JNE', 'NE': 'JE'}
+
+    # The same jump with its operands exchanged.
+    SWAPPED = {'JLT': 'JGT', 'JLTE': 'JGTE', 'JGT': 'JLT', 'JGTE': 'JLTE', 'JE': 'JE', 'JNE': 'JNE'}
+
+    def __init__(self):
+        super(RegisterCompiler, self).__init__()
+        self.temporaries = 0
+        self.code = []
+
+    def generate(self, node):
+        self.push()
+        self.visit_node(node)
+        self.pop()
+
+        for line in self.code:
+            if isinstance(line, str):
+                print line + ":"
+            else:
+                print "\t" + " ".join(str(word) for word in line)
+
+    def emit(self, *instruction):
+        self.code.append(list(instruction))
+
+    def label(self, name):
+        self.code.append(name)
+
+    def temporary(self):
+        name = "%" + `self.temporaries`
+        self.temporaries += 1
+        return name
+
+    def register(self, value):
+        # Constants are only allowed as the last operand, so load them if necessary.
+        if isinstance(value, int):
+            result = self.temporary()
+            self.emit("MOV", result, value)
+            return result
+
+        return value
+
+    def arithmetic(self, operator, lhs, rhs, mark):
+        if isinstance(lhs, int):
+            if operator in ('ADD', 'MUL') and not isinstance(rhs, int):
+                lhs, rhs = rhs, lhs
+            else:
+                lhs = self.register(lhs)
+
+        # The operands are read before the result is written, so it can reuse their registers.
+        self.temporaries = mark
+        result = self.temporary()
+        self.emit(operator, result, lhs, rhs)
+
+        return result
+
+    def branch(self, condition, label):
+        # Jumps to label if the condition is false.
+        if condition[0] == 'ODD':
+            value = self.register(self.visit_node(condition[1]))
+            self.emit("JEVEN", value, label)
+        else:
+            lhs = self.visit_node(condition[1])
+            rhs = self.visit_node(condition[3])
+            jump = self.INVERSE[condition[2]]
+
+            if isinstance(lhs, int):
+                if isinstance(rhs, int):
+                    lhs = self.register(lhs)
+                else:
+                    lhs, rhs = rhs, lhs
+                    jump = self.SWAPPED[jump]
+
+            self.emit(jump, lhs, rhs, label)
+
+        self.temporaries = 0
+
+    def accept_variables(self, *node):
+        for var in node[1:]:
+            variable_name = self.intermediate_label('var_' + var[1])
+            self.stack[-1].update(var[1], variable_name)
+
+            # Each variable is allocated a register.
+            self.emit("VAR", variable_name)
+
+    def accept_procedures(self, *node):
+        for proc in node[1:]:
+            proc_name = self.intermediate_label('proc_' + proc[1])
+            self.stack[-1].declare(proc[1], proc_name)
+
+            self.push()
+
+            self.visit_expressions(proc[2][1:4])
+
+            self.label(proc_name)
+
+            registers = [self.find(var[1])[1] for var in (proc[2][2] or [])[1:]]
+            for register in registers:
+                self.emit("SAVE", register)
+                self.emit("MOV", register, 0)
+
+            self.visit_node(proc[2][4])
+
+            for register in reversed(registers):
+                self.emit("RESTORE", register)
+            self.emit("RET")
+
+            self.pop()
+
+    def accept_program(self, *node):
+        self.emit("JMP", "main")
+
+        block = node[1]
+        self.visit_expressions(block[1:4])
+
+        self.label("main")
+        self.visit_node(block[4])
+        self.emit("HALT")
+
+    def accept_while(self, *node):
+        top_label = self.intermediate_label("while_start")
+        bottom_label = self.intermediate_label("while_end")
+
+        self.label(top_label)
+        self.branch(node[1], bottom_label)
+
+        self.visit_node(node[2])
+
+        self.emit("JMP", top_label)
+        self.label(bottom_label)
+
+    def accept_if(self, *node):
+        false_label = self.intermediate_label("if_false")
+
+        self.branch(node[1], false_label)
+        self.visit_node(node[2])
+
+        self.label(false_label)
+
+    def accept_set(self, *node):
+        assign_to = node[1][1]
+        defined, value, level = self.find(assign_to)
+
+        if defined != 'VARIABLE':
+            raise NameError("Invalid assignment to non-variable " + assign_to + " of type " + defined)
+
+        result = self.visit_node(node[2])
+        last = self.code[-1] if self.code else None
+
+        if result == value:
+            pass
+        elif isinstance(last, list) and last[1] == result and str(result).startswith("%"):
+            # Write the result of the last instruction directly into the variable.
+            last[1] = value
+        else:
+            self.emit("MOV", value, result)
+
+        self.temporaries = 0
+
+    def accept_call(self, *node):
+        defined, value, level = self.find(node[1])
+
+        if defined != 'PROCEDURE':
+            raise NameError("Expecting procedure but got: " + defined)
+
+        self.emit("CALL", value)
+
+    def accept_term(self, *node):
+        mark = self.temporaries
+        total = self.visit_node(node[1])
 
         for term in node[2:]:
-            self.visit_node(term[1])
+            value = self.visit_node(term[1])
 
             if term[0] == 'TIMES':
-                print "\tMUL"
-            elif term[0] == 'DIVIDES':
-                print "\tDIV"
-
+                total = self.arithmetic("MUL", total, value, mark)
+            elif term[0] == 'DIVIDE':
+                total = self.arithmetic("DIV", total, value, mark)
+
+        return total
+
     def accept_expression(self, *node):
-        # Result of this expression will be on the top of stack
-        self.visit_node(node[2])
+        mark = self.temporaries
+        total = self.visit_node(node[2])
 
         for term in node[3:]:
-            self.visit_node(term[1])
+            value = self.visit_node(term[1])
 
             if term[0] == 'PLUS':
-                print "\tADD"
+                total = self.arithmetic("ADD", total, value, mark)
             elif term[0] == 'MINUS':
-                print "\tSUB"
+                total = self.arithmetic("SUB", total, value, mark)
 
         if node[1] == 'MINUS':
-            print "\tPUSH -1"
-            print "\tMUL"
-
+            total = self.arithmetic("MUL", total, -1, mark)
+
+        return total
+
     def accept_print(self, *node):
-        self.visit_node(node[1])
-        print "\tPRINT"
-        print "\tPOP"
+        self.emit("PRINT", self.visit_node(node[1]))
+        self.temporaries = 0
 
     def accept_number(self, *node):
-        print "\tPUSH " + `node[1]`
+        return node[1]
 
     def accept_name(self, *node):
         defined, value, level = self.find(node[1])
 
-        if defined == 'VARIABLE':
-            print "\tLOAD", value
-        elif defined == 'CONSTANT':
-            print "\tPUSH", value
+        if defined in ('VARIABLE', 'CONSTANT'):
+            return value
         else:
             raise NameError("Invalid value name " + node[1] + " of type " + defined)
 
+def compile_source(code, optimize = False):
+    # Parses, compiles and assembles source in one step, returning the sequence for pl0_machine.
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = parser.p_program()
+
+    if optimize:
+        program = pl0_optimizer.Optimizer().optimize(program)
+
+    assembler = pl0_assembler.Assembler()
+    Compiler(assembler).generate(program)
+
+    return assembler.code()
+
 if __name__ == '__main__':
     code = sys.stdin.read()
     parser = pl0_parser.Parser()
     parser.input(code)
     program = parser.p_program()
 
-    compiler = Compiler()
+    if '--optimize' in sys.argv:
+        program = pl0_optimizer.Optimizer().optimize(program)
+
+    if '--registers' in sys.argv:
+        compiler = RegisterCompiler()
+    else:
+        compiler = Compiler()
+
     compiler.generate(program)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import pl0_parser
+import pl0_resolver
+
+class Analyzer:
+    """
+    Computes the effects of each procedure in a resolved program on the
+    variables outside of it: the variables it may read before writing, the
+    variables it may write, and the variables it writes on every path
+    which returns. Addresses are (depth, slot) pairs relative to the frame
+    of the procedure's parent, that is, the frame a CALL links it to.
+
+    Calls are followed through the summaries of the procedures they call,
+    which are computed together until none of them change. Writes which
+    must happen start out as every variable (None), and shrink from there.
+    """
+
+    def __init__(self):
+        # The name, block and lexically enclosing blocks of each procedure, by id.
+        self.names = {}
+        self.blocks = {}
+        self.scopes = {}
+
+        # (reads, writes, musts), by the id of the procedure block.
+        self.summaries = {}
+
+    def analyze(self, program):
+        self.collect(program[1], [])
+
+        for key in self.blocks:
+            self.summaries[key] = (frozenset(), frozenset(), None)
+
+        changed = True
+        while changed:
+            changed = False
+
+            for key, block in self.blocks.items():
+                summary = self.summarize(block, self.scopes[key])
+
+                if summary != self.summaries[key]:
+                    self.summaries[key] = summary
+                    changed = True
+
+        return self.summaries
+
+    def collect(self, block, scope):
+        scope = scope + [block]
+
+        for (name, kind), value in zip(block[5], block[6]):
+            if kind == 'PROCEDURE':
+                self.names[id(value)] = name
+                self.blocks[id(value)] = value
+                self.scopes[id(value)] = scope + [value]
+                self.collect(value, scope)
+
+    def summarize(self, block, scope):
+        reads = set()
+        writes = set()
+
+        musts = self.statement(block[4], scope, set(), reads, writes)
+
+        # Only addresses outside of the procedure's own frame are effects.
+        def outside(addresses):
+            return frozenset((depth - 1, slot) for depth, slot in addresses if depth > 0)
+
+        if musts is not None:
+            musts = outside(musts)
+
+        return (outside(reads), outside(writes), musts)
+
+    def expression(self, node, must, reads):
+        if node[0] == 'NAME':
+            if node[2] not in must:
+                reads.add(node[2])
+            return
+
+        for child in node[1:]:
+            if isinstance(child, (list, tuple)):
+                self.expression(child, must, reads)
+
+    def statement(self, node, scope, must, reads, writes):
+        # Returns the variables written on every path through the statement,
+        # or None if it doesn't return.
+        if node is None or must is None:
+            return must
+
+        kind = node[0]
+
+        if kind == 'SET':
+            self.expression(node[2], must, reads)
+            writes.add(node[3])
+            return must | set([node[3]])
+
+        if kind == 'BEGIN':
+            for statement in node[1:]:
+                must = self.statement(statement, scope, must, reads, writes)
+            return must
+
+        if kind in ['IF', 'WHILE']:
+            # The body may not be executed at all.
+            self.expression(node[1], must, reads)
+            self.statement(node[2], scope, set(must), reads, writes)
+            return must
+
+        if kind == 'PRINT':
+            self.expression(node[1], must, reads)
+            return must
+
+        if kind == 'CALL':
+            depth, slot = node[2]
+            callee = scope[-1 - depth][6][slot]
+            callee_reads, callee_writes, callee_musts = self.summaries[id(callee)]
+
+            # The callee's parent is the frame at the depth of the call.
+            for address in callee_reads:
+                address = (address[0] + depth, address[1])
+                if address not in must:
+                    reads.add(address)
+
+            writes.update((address[0] + depth, address[1]) for address in callee_writes)
+
+            if callee_musts is None:
+                return None
+
+            return must | set((address[0] + depth, address[1]) for address in callee_musts)
+
+        return must
+
+if __name__ == '__main__':
+    code = sys.stdin.read()
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = pl0_resolver.Resolver().resolve(parser.p_program())
+
+    analyzer = Analyzer()
+    analyzer.analyze(program)
+
+    for key, (reads, writes, musts) in analyzer.summaries.items():
+        print "Procedure %s" % analyzer.names[key]
+        print "  Reads: %r" % sorted(reads)
+        print "  Writes: %r" % sorted(writes)
+        print "  Must write: %r" % (sorted(musts) if musts is not None else None)
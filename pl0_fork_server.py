@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import sys
+import ast
+import marshal
+import StringIO
+import traceback
+import pl0_machine
+import pl0_bytecode
+
+class ContinuationError(Exception):
+    pass
+
+def capture(function, *arguments):
+    buffer = StringIO.StringIO()
+    stdout, sys.stdout = sys.stdout, buffer
+    try:
+        function(*arguments)
+    finally:
+        sys.stdout = stdout
+
+    return buffer.getvalue()
+
+class ForkServer:
+    """
+    Runs a machine up to its first MARK instruction once, and then serves
+    continuations from there. Each continuation assigns some variables and
+    runs the rest of the program in a child process forked from the warm
+    machine, so the shared prefix is only computed once and its memory is
+    shared copy-on-write. Where os.fork isn't available, each continuation
+    restores a snapshot of the warm machine instead.
+    """
+
+    def __init__(self, machine, processes = 8):
+        self.machine = machine
+        self.processes = processes
+
+        self.status = machine.run_to_marker()
+        self.snapshot = machine.snapshot()
+
+    def slot(self, name):
+        # Variables are named by assembler label or by sequence offset.
+        image = self.machine.image
+
+        if name in image.symbols:
+            offset = image.symbols[name]
+        elif name.isdigit():
+            offset = int(name)
+        else:
+            raise KeyError("Unknown variable %s" % name)
+
+        if offset not in image.variables:
+            raise KeyError("%s is not a variable" % name)
+
+        return image.variables.index(offset)
+
+    def continue_machine(self, machine, assignments):
+        for name, value in assignments.iteritems():
+            machine.data[self.slot(name)] = value
+
+        output = capture(machine.run_fast)
+        return output, list(machine.data)
+
+    def serve(self, continuations):
+        # Returns the output and final data of each continuation, in order.
+        if hasattr(os, 'fork'):
+            results = []
+
+            for i in xrange(0, len(continuations), self.processes):
+                results += self.serve_forked(continuations[i:i + self.processes])
+
+            return results
+        else:
+            machine_class = self.machine.__class__
+            return [self.continue_machine(machine_class.from_snapshot(self.snapshot), assignments) for assignments in continuations]
+
+    def serve_forked(self, continuations):
+        children = []
+
+        # Buffered output would otherwise be written again by each child.
+        sys.stdout.flush()
+
+        for assignments in continuations:
+            read, write = os.pipe()
+            pid = os.fork()
+
+            if pid == 0:
+                os.close(read)
+
+                try:
+                    payload = marshal.dumps((self.continue_machine(self.machine, assignments), None))
+                except:
+                    payload = marshal.dumps((None, traceback.format_exc()))
+
+                with os.fdopen(write, 'wb') as stream:
+                    stream.write(payload)
+
+                os._exit(0)
+
+            os.close(write)
+            children.append((pid, read))
+
+        results = []
+        errors = []
+
+        for pid, read in children:
+            with os.fdopen(read, 'rb') as stream:
+                payload = stream.read()
+
+            os.waitpid(pid, 0)
+
+            if not payload:
+                errors.append("Continuation process %d exited without a result" % pid)
+                continue
+
+            result, error = marshal.loads(payload)
+
+            if error:
+                errors.append(error)
+            else:
+                results.append(result)
+
+        if errors:
+            raise ContinuationError(errors[0])
+
+        return results
+
+def parse_assignments(argument):
+    # "name=value,name=value"
+    assignments = {}
+
+    for assignment in argument.split(','):
+        if assignment:
+            name, value = assignment.split('=')
+            assignments[name.strip()] = int(value)
+
+    return assignments
+
+if __name__ == '__main__':
+    # Warms up the program given as a binary image, or as a sequence on stdin,
+    # and then runs one continuation for each argument, e.g. "x=2,y=3".
+    arguments = sys.argv[1:]
+
+    if arguments and arguments[0].endswith('.pl0b'):
+        image = pl0_bytecode.load_image(arguments.pop(0))
+        machine = pl0_machine.Machine.from_image(pl0_machine.fuse(image))
+    else:
+        machine = pl0_machine.Machine(None)
+        machine.load(pl0_machine.fuse(pl0_machine.decode(ast.literal_eval(sys.stdin.read()))))
+
+    server = ForkServer(machine)
+    print "Warm: %s at offset %d" % (server.status, machine.offset)
+
+    for argument, (output, data) in zip(arguments, server.serve([parse_assignments(argument) for argument in arguments])):
+        print "Continuation %s:" % argument
+        sys.stdout.write(output)
+        print "Data: %r" % data
@@ -23,9 +23,17 @@
 
 import os
 import sys
+import time
 import StringIO
 import pl0_parser
-from pl0_node_visitor import StackingNodeVisitor
+import pl0_output
+import pl0_machine
+import pl0_resolver
+import pl0_effects
+import pl0_budget
+import pl0_optimizer
+import collections
+from pl0_node_visitor import NodeVisitor, StackingNodeVisitor, Block
 
 class Procedure:
 
@@ -36,11 +44,32 @@ class Procedure:
 
 class Interpreter(StackingNodeVisitor):
 
+    def __init__(self, output = None, budget = None):
+        super(Interpreter, self).__init__()
+
+        # Where printed values are written, see pl0_output.
+        self.output = output or pl0_output.Output()
+
+        # Checked at each loop iteration and call, see pl0_budget.
+        self.budget = budget
+
     def evaluate(self, node):
         self.push()
         result = self.visit_node(node)
         return [self.pop(), result]
 
+    def stack_depth(self):
+        return len(self.stack)
+
+    def accept_program(self, *node):
+        if self.budget:
+            self.budget.start()
+
+        try:
+            return self.visit_children(node)
+        finally:
+            self.output.flush()
+
 
     def accept_variables(self, *node):
         for var in node[1:]:
@@ -71,6 +100,9 @@ class Interpreter(StackingNodeVisitor):
             if not result:
                 break
 
+            if self.budget:
+                self.budget.check(self)
+
             self.evaluate(loop)
 
     def accept_if(self, *node):
@@ -99,8 +131,10 @@ class Interpreter(StackingNodeVisitor):
             return lhs[1] > rhs[1]
         if operator == 'GTE':
             return lhs[1] >= rhs[1]
-        if operator == 'EQ':
+        if operator == 'E':
             return lhs[1] == rhs[1]
+        if operator == 'NE':
+            return lhs[1] != rhs[1]
 
         raise ArithmeticError("Unknown comparison operator " + operator)
 
@@ -118,6 +152,9 @@ class Interpreter(StackingNodeVisitor):
         if defined != 'PROCEDURE':
             raise NameError("Expecting procedure but got: " + defined)
 
+        if self.budget:
+            self.budget.check(self)
+
         block, result = self.evaluate(value.node)
         return result
 
@@ -129,7 +166,7 @@ class Interpreter(StackingNodeVisitor):
 
             if term[0] == 'TIMES':
                 total = total * result
-            elif term[0] == 'DIVIDES':
+            elif term[0] == 'DIVIDE':
                 total = total / result
 
         return total
@@ -153,15 +190,695 @@ class Interpreter(StackingNodeVisitor):
     def accept_print(self, *node):
         block, result = self.evaluate(node[1])
 
-        print `result`
+        self.output.write(`result`)
 
+class NodeProfile:
+    """
+    The number of times each node of a program was evaluated, and the time
+    spent evaluating it, both including and excluding the nodes within it.
+    Nodes are keyed by id, so the tree must outlive the profile, and lines
+    are those recorded by the parser, see pl0_parser.line_of().
+    """
+
+    STATEMENTS = ('SET', 'CALL', 'BEGIN', 'IF', 'WHILE', 'PRINT')
+
+    def __init__(self):
+        self.nodes = {}
+        self.counts = collections.defaultdict(int)
+        self.times = collections.defaultdict(float)
+        self.own = collections.defaultdict(float)
+
+    def record(self, node, elapsed, own):
+        key = id(node)
+
+        self.nodes[key] = node
+        self.counts[key] += 1
+        self.times[key] += elapsed
+        self.own[key] += own
+
+    def statements(self):
+        # (line, kind, count, time) of each statement which was executed, the slowest first.
+        result = []
+
+        for key, node in self.nodes.iteritems():
+            line = pl0_parser.line_of(node)
+
+            if node[0] in self.STATEMENTS and line is not None:
+                result.append((line, node[0], self.counts[key], self.times[key]))
+
+        return sorted(result, key = lambda statement: -statement[3])
+
+    def annotate(self, source):
+        # Executions of the statements which begin on each line, and the time spent on that line alone.
+        counts = collections.defaultdict(int)
+        times = collections.defaultdict(float)
+
+        for key, node in self.nodes.iteritems():
+            line = pl0_parser.line_of(node)
+
+            if line is None:
+                continue
+
+            if node[0] in self.STATEMENTS:
+                counts[line] += self.counts[key]
+
+            times[line] += self.own[key]
+
+        output = []
+
+        for number, text in enumerate(source.splitlines(), 1):
+            if number in counts or number in times:
+                output.append("%10d %10.3fms | %s" % (counts[number], times[number] * 1000, text))
+            else:
+                output.append("%10s %12s | %s" % ('', '', text))
+
+        output.append('')
+        output.append("%6s %-6s %10s %12s" % ('Line', 'Node', 'Count', 'Time'))
+
+        for line, kind, count, elapsed in self.statements():
+            output.append("%6d %-6s %10d %10.3fms" % (line, kind, count, elapsed * 1000))
+
+        return "\n".join(output) + "\n"
+
+class ProfilingInterpreter(Interpreter):
+    """
+    An interpreter which times every node it evaluates, see NodeProfile.
+    """
+
+    def __init__(self, output = None):
+        super(ProfilingInterpreter, self).__init__(output)
+
+        self.profile = NodeProfile()
+
+        # The time spent in the nodes within each node being evaluated.
+        self.nested = []
+
+    def visit_node(self, node):
+        if node is None:
+            return None
+
+        self.nested.append(0.0)
+        start = time.time()
+
+        try:
+            return super(ProfilingInterpreter, self).visit_node(node)
+        finally:
+            elapsed = time.time() - start
+            self.profile.record(node, elapsed, elapsed - self.nested.pop())
+
+            if self.nested:
+                self.nested[-1] += elapsed
+
+class Frame(object):
+    """
+    The slots of one activation of a resolved block, linked to the frame of
+    the block which lexically encloses it.
+    """
+
+    # There may be a great many of these when recursion is deep.
+    __slots__ = ('parent', 'names', 'slots')
+
+    def __init__(self, parent, names, slots):
+        self.parent = parent
+        self.names = names
+        self.slots = slots
+
+    def block(self):
+        result = Block()
+
+        for (name, kind), value in zip(self.names, self.slots):
+            if kind == 'CONSTANT':
+                result.define(name, value)
+            elif kind == 'VARIABLE':
+                result.update(name, value)
+            else:
+                result.declare(name, Procedure(name, value, result))
+
+        return result
+
+class ResolvedInterpreter(NodeVisitor):
+    """
+    Runs a syntax tree annotated by pl0_resolver. Names are looked up by
+    following static links and indexing the slots of a frame, rather than
+    by searching every block on the stack, so scoping is lexical, as it is
+    for the compiled program.
+    """
+
+    def __init__(self, output = None):
+        # Where printed values are written, see pl0_output.
+        self.output = output or pl0_output.Output()
+        self.frame = None
+
+    def evaluate(self, program):
+        return self.visit_node(program)
+
+    def lookup(self, depth):
+        frame = self.frame
+
+        for i in xrange(depth):
+            frame = frame.parent
+
+        return frame
+
+    def execute(self, block, parent):
+        caller = self.frame
+        self.frame = Frame(parent, block[5], list(block[6]))
+
+        try:
+            self.visit_node(block[4])
+            return self.frame
+        finally:
+            self.frame = caller
+
+    def accept_program(self, nid, block):
+        try:
+            return self.execute(block, None)
+        finally:
+            self.output.flush()
+
+    def accept_set(self, nid, target, expression, address):
+        result = self.visit_node(expression)
+
+        depth, slot = address
+        self.lookup(depth).slots[slot] = result
+
+    def accept_while(self, nid, condition, loop):
+        while self.visit_node(condition):
+            self.visit_node(loop)
+
+    def accept_if(self, nid, condition, body):
+        if self.visit_node(condition):
+            self.visit_node(body)
+
+    def accept_odd(self, nid, expr):
+        return self.visit_node(expr) % 2 != 0
+
+    def accept_condition(self, nid, lhs, operator, rhs):
+        lhs = self.visit_node(lhs)
+        rhs = self.visit_node(rhs)
+
+        if operator == 'LT':
+            return lhs < rhs
+        if operator == 'LTE':
+            return lhs <= rhs
+        if operator == 'GT':
+            return lhs > rhs
+        if operator == 'GTE':
+            return lhs >= rhs
+        if operator == 'E':
+            return lhs == rhs
+        if operator == 'NE':
+            return lhs != rhs
+
+        raise ArithmeticError("Unknown comparison operator " + operator)
+
+    def accept_number(self, nid, value):
+        return value
+
+    def accept_name(self, nid, name, address):
+        depth, slot = address
+        return self.lookup(depth).slots[slot]
+
+    def accept_call(self, nid, name, address):
+        depth, slot = address
+        parent = self.lookup(depth)
+
+        self.execute(parent.slots[slot], parent)
+
+    def accept_term(self, *node):
+        total = self.visit_node(node[1])
+
+        for term in node[2:]:
+            result = self.visit_node(term[1])
+
+            if term[0] == 'TIMES':
+                total = total * result
+            elif term[0] == 'DIVIDE':
+                total = total / result
+
+        return total
+
+    def accept_expression(self, *node):
+        total = self.visit_node(node[2])
+
+        for term in node[3:]:
+            result = self.visit_node(term[1])
+
+            if term[0] == 'PLUS':
+                total = total + result
+            elif term[0] == 'MINUS':
+                total = total - result
+
+        if node[1] == 'MINUS':
+            total = total * -1;
+
+        return total
+
+    def accept_print(self, nid, expression):
+        result = self.visit_node(expression)
+
+        self.output.write(`result`)
+
+class CallCache:
+    """
+    A least recently used cache of the results of procedure calls, which
+    counts its hits, misses and evictions.
+    """
+
+    SIZE = 4096
+
+    def __init__(self, size = None):
+        self.size = size or self.SIZE
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = entry
+
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+    def statistics(self):
+        return "Cache: %d hits, %d misses, %d evictions, %d entries" % (self.hits, self.misses, self.evictions, len(self.entries))
+
+class MemoizingInterpreter(ResolvedInterpreter):
+    """
+    A resolved interpreter which caches the effects of procedure calls. The
+    key of a call is the procedure and the values of the variables it reads
+    before writing, as found by pl0_effects, and the entry is the final
+    values of the variables it writes, and the values it printed. A call
+    which hits the cache replays these instead of running the procedure.
+    A variable which is written on some paths but not all of them may keep
+    its value from before the call, so it is part of the key too.
+    """
+
+    def __init__(self, summaries, output = None, size = None):
+        ResolvedInterpreter.__init__(self, output)
+
+        # The addresses each procedure depends on and writes, in a fixed order.
+        self.effects = {}
+        for key, (reads, writes, musts) in summaries.items():
+            if musts is not None:
+                reads = reads | (writes - musts)
+
+            self.effects[key] = (tuple(sorted(reads)), tuple(sorted(writes)))
+
+        self.cache = CallCache(size)
+
+        # Values printed since the outermost active call began.
+        self.printed = []
+        self.calls = 0
+
+    def ancestor(self, frame, depth):
+        for i in xrange(depth):
+            frame = frame.parent
+
+        return frame
+
+    def accept_call(self, nid, name, address):
+        depth, slot = address
+        parent = self.lookup(depth)
+        block = parent.slots[slot]
+
+        reads, writes = self.effects[id(block)]
+        key = (id(block),) + tuple(self.ancestor(parent, depth).slots[slot] for depth, slot in reads)
+
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            values, printed = entry
+
+            for (depth, slot), value in zip(writes, values):
+                self.ancestor(parent, depth).slots[slot] = value
+
+            for text in printed:
+                self.write(text)
+
+            return
+
+        start = len(self.printed)
+        self.calls += 1
+
+        try:
+            self.execute(block, parent)
+            printed = tuple(self.printed[start:])
+        finally:
+            self.calls -= 1
+
+            if not self.calls:
+                del self.printed[:]
+
+        values = tuple(self.ancestor(parent, depth).slots[slot] for depth, slot in writes)
+        self.cache.put(key, (values, printed))
+
+    def write(self, text):
+        self.output.write(text)
+
+        if self.calls:
+            self.printed.append(text)
+
+    def accept_print(self, nid, expression):
+        result = self.visit_node(expression)
+
+        self.write(`result`)
+
+# Nodes which are evaluated without scheduling any further work.
+LEAVES = ('NUMBER', 'NAME')
+
+class IterativeInterpreter:
+    """
+    Runs a syntax tree annotated by pl0_resolver without recursion in Python,
+    so that neither deep recursion in the program nor deeply nested
+    expressions are limited by the Python stack. Pending work is a stack of
+    (function, argument) continuations, and intermediate results are kept
+    on a separate stack of values. A call in tail position doesn't push a
+    continuation to restore the caller's frame, since one is already on top,
+    so tail recursion runs in constant memory.
+    """
+
+    def __init__(self, output = None):
+        # Where printed values are written, see pl0_output.
+        self.output = output or pl0_output.Output()
+        self.frame = None
+
+        self.work = []
+        self.values = []
+
+        self.table = {}
+        for name in dir(self):
+            if name.startswith('schedule_'):
+                self.table[name[9:].upper()] = getattr(self, name)
+
+        # Bind the continuations once, rather than each time one is pushed.
+        for name in ('visit', 'apply', 'store', 'repeat', 'branch', 'odd', 'compare', 'operate', 'leave', 'write'):
+            setattr(self, name, getattr(self, name))
+        self.schedule_while = self.table['WHILE']
+
+    def evaluate(self, program):
+        work = self.work
+        work.append((self.visit, program))
+
+        try:
+            while work:
+                function, argument = work.pop()
+                function(argument)
+
+            return self.frame
+        finally:
+            del work[:]
+            del self.values[:]
+            self.output.flush()
+
+    def visit(self, node):
+        self.table[node[0]](node)
+
+    def lookup(self, depth):
+        frame = self.frame
+
+        for i in xrange(depth):
+            frame = frame.parent
+
+        return frame
+
+    def schedule_program(self, node):
+        block = node[1]
+
+        self.frame = Frame(None, block[5], list(block[6]))
+        self.work.append((self.visit, block[4]))
+
+    def schedule_set(self, node):
+        self.work.append((self.store, node[3]))
+        self.work.append((self.visit, node[2]))
+
+    def store(self, address):
+        depth, slot = address
+        self.lookup(depth).slots[slot] = self.values.pop()
+
+    def schedule_begin(self, node):
+        self.work.extend([(self.visit, statement) for statement in reversed(node[1:])])
+
+    def schedule_while(self, node):
+        self.work.append((self.repeat, node))
+        self.work.append((self.visit, node[1]))
+
+    def repeat(self, node):
+        if self.values.pop():
+            self.work.append((self.schedule_while, node))
+            self.work.append((self.visit, node[2]))
+
+    def schedule_if(self, node):
+        self.work.append((self.branch, node[2]))
+        self.work.append((self.visit, node[1]))
+
+    def branch(self, body):
+        if self.values.pop():
+            self.work.append((self.visit, body))
+
+    def schedule_odd(self, node):
+        self.work.append((self.odd, None))
+        self.work.append((self.visit, node[1]))
+
+    def odd(self, argument):
+        self.values[-1] = self.values[-1] % 2 != 0
+
+    def schedule_condition(self, node):
+        self.work.append((self.compare, node[2]))
+        self.work.append((self.visit, node[3]))
+        self.work.append((self.visit, node[1]))
+
+    def compare(self, operator):
+        rhs = self.values.pop()
+        lhs = self.values.pop()
+
+        if operator == 'LT':
+            result = lhs < rhs
+        elif operator == 'LTE':
+            result = lhs <= rhs
+        elif operator == 'GT':
+            result = lhs > rhs
+        elif operator == 'GTE':
+            result = lhs >= rhs
+        elif operator == 'E':
+            result = lhs == rhs
+        elif operator == 'NE':
+            result = lhs != rhs
+        else:
+            raise ArithmeticError("Unknown comparison operator " + operator)
+
+        self.values.append(result)
+
+    def schedule_term(self, node):
+        self.schedule_operands(node[1], node[2:])
+
+    def schedule_expression(self, node):
+        if node[1] == 'MINUS':
+            self.work.append((self.operate, 'NEGATE'))
+
+        self.schedule_operands(node[2], node[3:])
+
+    def schedule_operands(self, first, rest):
+        work = self.work
+
+        for operator, operand in reversed(rest):
+            operand = self.unwrap(operand)
+
+            if operand[0] in LEAVES:
+                work.append((self.apply, (operator, operand)))
+            else:
+                work.append((self.operate, operator))
+                work.append((self.visit, operand))
+
+        # The first operand would be evaluated next anyway, so a leaf is evaluated now.
+        first = self.unwrap(first)
+
+        if first[0] in LEAVES:
+            self.table[first[0]](first)
+        else:
+            work.append((self.visit, first))
+
+    def unwrap(self, node):
+        # A term with a single factor has the value of that factor.
+        if node[0] == 'TERM' and len(node) == 2:
+            return node[1]
+
+        return node
+
+    def apply(self, argument):
+        operator, operand = argument
+
+        self.table[operand[0]](operand)
+        self.operate(operator)
+
+    def operate(self, operator):
+        values = self.values
+
+        if operator == 'NEGATE':
+            values[-1] = values[-1] * -1
+            return
+
+        result = values.pop()
+
+        if operator == 'PLUS':
+            values[-1] = values[-1] + result
+        elif operator == 'MINUS':
+            values[-1] = values[-1] - result
+        elif operator == 'TIMES':
+            values[-1] = values[-1] * result
+        elif operator == 'DIVIDE':
+            values[-1] = values[-1] / result
+
+    def schedule_number(self, node):
+        self.values.append(node[1])
+
+    def schedule_name(self, node):
+        depth, slot = node[2]
+        self.values.append(self.lookup(depth).slots[slot])
+
+    def schedule_call(self, node):
+        depth, slot = node[2]
+        parent = self.lookup(depth)
+        block = parent.slots[slot]
+
+        work = self.work
+
+        # Only the outermost of several returns in a row needs to restore a frame.
+        if not work or work[-1][0] != self.leave:
+            work.append((self.leave, self.frame))
+
+        self.frame = Frame(parent, block[5], list(block[6]))
+        work.append((self.visit, block[4]))
+
+    def leave(self, frame):
+        self.frame = frame
+
+    def schedule_print(self, node):
+        self.work.append((self.write, None))
+        self.work.append((self.visit, node[1]))
+
+    def write(self, argument):
+        self.output.write(`self.values.pop()`)
+
+class CooperativeInterpreter(IterativeInterpreter):
+    """
+    An iterative interpreter which runs a program in time slices, so that
+    many programs can share one thread. Once its slice has run out, the
+    program is suspended at the next WHILE back-edge or CALL, since only
+    loops and calls can run for an unbounded time, and resume() continues
+    from there. This tree targets Python 2, which has no asyncio, so the
+    host drives resume() or the generator from run(), see pl0_scheduler.
+    """
+
+    SLICE = 0.01
+
+    def __init__(self, program, output = None, slice = None):
+        IterativeInterpreter.__init__(self, output)
+
+        self.slice = slice or self.SLICE
+        self.status = pl0_machine.SUSPENDED
+        self.steps = 0
+
+        self.deadline = None
+        self.yielding = False
+
+        self.work.append((self.visit, program))
+
+    def checkpoint(self):
+        if time.time() >= self.deadline:
+            self.yielding = True
+
+    def repeat(self, node):
+        self.checkpoint()
+        IterativeInterpreter.repeat(self, node)
+
+    def schedule_call(self, node):
+        self.checkpoint()
+        IterativeInterpreter.schedule_call(self, node)
+
+    def resume(self, slice = None):
+        if self.status != pl0_machine.SUSPENDED:
+            return self.status
+
+        work = self.work
+        steps = 0
+
+        self.yielding = False
+        self.deadline = time.time() + (slice or self.slice)
+
+        try:
+            while work and not self.yielding:
+                function, argument = work.pop()
+                function(argument)
+                steps += 1
+        except:
+            self.finish(pl0_machine.FAILED)
+            raise
+        finally:
+            self.steps += steps
+
+        if not work:
+            self.finish(pl0_machine.HALTED)
+
+        return self.status
+
+    def run(self):
+        # Yields after each time slice until the program has finished.
+        while self.resume() == pl0_machine.SUSPENDED:
+            yield self.status
+
+    def cancel(self):
+        if self.status == pl0_machine.SUSPENDED:
+            self.finish(pl0_machine.CANCELLED)
+
+    def finish(self, status):
+        self.status = status
+
+        del self.work[:]
+        del self.values[:]
+        self.output.flush()
+
 if __name__ == '__main__':
     code = sys.stdin.read()
     parser = pl0_parser.Parser()
     parser.input(code)
     program = parser.p_program()
 
-    interpreter = Interpreter()
-    result, value = interpreter.evaluate(program)
+    if '--optimize' in sys.argv:
+        # Only the resolved interpreters look names up lexically.
+        dynamic = not set(['--memoize', '--iterative', '--resolved']).intersection(sys.argv)
+        program = pl0_optimizer.Optimizer(dynamic).optimize(program)
+
+    if '--profile' in sys.argv:
+        interpreter = ProfilingInterpreter()
+        result, value = interpreter.evaluate(program)
+        sys.stderr.write(interpreter.profile.annotate(code))
+    elif '--memoize' in sys.argv:
+        program = pl0_resolver.Resolver().resolve(program)
+        interpreter = MemoizingInterpreter(pl0_effects.Analyzer().analyze(program))
+        result = interpreter.evaluate(program).block()
+        print >> sys.stderr, interpreter.cache.statistics()
+    elif '--iterative' in sys.argv:
+        program = pl0_resolver.Resolver().resolve(program)
+        result = IterativeInterpreter().evaluate(program).block()
+    elif '--resolved' in sys.argv:
+        program = pl0_resolver.Resolver().resolve(program)
+        result = ResolvedInterpreter().evaluate(program).block()
+    else:
+        interpreter = Interpreter(budget = pl0_budget.parse_arguments(sys.argv[1:]))
+        result, value = interpreter.evaluate(program)
 
     result.debug()
@@ -22,6 +22,13 @@
 #
 
 import sys
+import ast
+import time
+import json
+import array
+import marshal
+import operator
+import pl0_output
 
 OPCODES = {
     'NOP': 0,
@@ -30,6 +37,10 @@ OPCODES = {
     'LOAD': 6,
     'SAVE': 7,
 
+    # Locals of procedures, see Frames.
+    'LOADL': 8,
+    'SAVEL': 9,
+
     'PUSH': 10,
     'POP': 11,
     'DUP': 12,
@@ -45,6 +56,9 @@ OPCODES = {
     'JGTE': 24,
     'JGT': 25,
 
+    'ENTER': 26,
+    'LEAVE': 27,
+
     # These instructions are more natural for stack-based machines.
     'CMPLT': 30,
     'CMPLTE': 31,
@@ -59,7 +73,16 @@ OPCODES = {
     'SUB': 46,
 
     'PRINT': 50,
-    'DEBUG': 51
+    'DEBUG': 51,
+
+    # Does nothing, but marks where run_to_marker() stops, see pl0_fork_server.
+    'MARK': 52,
+
+    # Superinstructions, which are only produced by fuse() on a decoded image.
+    'ADDVV': 60,
+    'JCMPVK': 61,
+    'SAVEK': 62,
+    'PRINTPOP': 63
 }
 
 NAMES = dict((v,k) for k, v in OPCODES.iteritems())
@@ -69,12 +92,484 @@ module = sys.modules[__name__]
 for name, value in OPCODES.iteritems():
     setattr(module, name, value)
 
+# Instructions which are followed by a single operand word.
+DATA_OPERANDS = (LOAD, SAVE)
+JUMP_OPERANDS = (JMP, CALL, JLT, JLTE, JE, JNE, JGTE, JGT)
+OPERANDS = (PUSH,) + DATA_OPERANDS + JUMP_OPERANDS
+
+# Instructions which are followed by two operand words, a static depth and a frame size or slot.
+FRAME_OPERANDS = (ENTER, LOADL, SAVEL)
+
+SUPERINSTRUCTIONS = (ADDVV, JCMPVK, SAVEK, PRINTPOP)
+
+# Conditional jumps, as a test on the value popped from the stack.
+CONDITIONS = {
+    JLT: lambda value: value > 0,
+    JLTE: lambda value: value >= 0,
+    JE: lambda value: value == 0,
+    JNE: lambda value: value != 0,
+    JGTE: lambda value: value <= 0,
+    JGT: lambda value: value < 0,
+}
+
+COMPARISONS = {
+    CMPLT: operator.lt,
+    CMPLTE: operator.le,
+    CMPE: operator.eq,
+    CMPNE: operator.ne,
+    CMPGTE: operator.ge,
+    CMPGT: operator.gt,
+}
+
+# The format of Machine.snapshot().
+SNAPSHOT_VERSION = 1
+
+# Status of a machine after a call to run() or run_fast().
+HALTED = 'HALTED'
+SUSPENDED = 'SUSPENDED'
+
+# Status of a scheduled program which was cancelled, or raised an exception.
+CANCELLED = 'CANCELLED'
+FAILED = 'FAILED'
+
+class Image:
+    """
+    A decoded program: a list of (opcode, operand) instructions with jump
+    operands resolved to instruction indices, and a separate data segment
+    with load/save operands resolved to slot indices.
+    """
+
+    def __init__(self, code, data, addresses, variables, fusions = None, symbols = None):
+        self.code = code
+        self.data = data
+
+        # The number of superinstructions of each kind, see fuse().
+        self.fusions = fusions or {}
+
+        # Assembler labels and their sequence offsets, if known.
+        self.symbols = symbols or {}
+
+        # The original sequence offset of each instruction and data slot.
+        self.addresses = addresses
+        self.variables = variables
+
+        # Return addresses on the stack remain sequence offsets.
+        self.index = dict(zip(addresses, xrange(len(addresses))))
+
+def decode(sequence):
+    instructions = {}
+    variables = set()
+
+    # Follow every path of control flow from the entry point, so that data
+    # words embedded in the sequence are never mistaken for instructions.
+    targets = [0]
+    while targets:
+        offset = targets.pop()
+
+        while 0 <= offset < len(sequence) and offset not in instructions:
+            opcode = sequence[offset]
+
+            if opcode not in NAMES or opcode in SUPERINSTRUCTIONS:
+                raise ValueError("Invalid instruction %r at offset %d" % (opcode, offset))
+
+            if opcode in OPERANDS:
+                operand = sequence[offset + 1]
+                instructions[offset] = (opcode, operand)
+                offset += 2
+            elif opcode in FRAME_OPERANDS:
+                instructions[offset] = (opcode, (sequence[offset + 1], sequence[offset + 2]))
+                offset += 3
+            else:
+                instructions[offset] = (opcode, None)
+                offset += 1
+
+            if opcode in DATA_OPERANDS:
+                variables.add(operand)
+            elif opcode in JUMP_OPERANDS:
+                targets.append(operand)
+
+            if opcode in (HALT, JMP, RET):
+                break
+
+    addresses = sorted(instructions)
+    variables = sorted(variables)
+
+    for address in variables:
+        if address in instructions or not 0 <= address < len(sequence):
+            raise ValueError("Invalid data address %d" % address)
+
+    # Jumps which leave the sequence end up on a trailing HALT.
+    index = dict((address, i) for i, address in enumerate(addresses))
+    slot = dict((address, i) for i, address in enumerate(variables))
+    end = len(addresses)
+
+    code = []
+    for address in addresses:
+        opcode, operand = instructions[address]
+
+        if opcode in DATA_OPERANDS:
+            operand = slot[operand]
+        elif opcode in JUMP_OPERANDS:
+            operand = index.get(operand, end)
+
+        code.append((opcode, operand))
+
+    code.append((HALT, None))
+    addresses.append(len(sequence))
+
+    data = [sequence[address] for address in variables]
+
+    return Image(code, data, addresses, variables)
+
+def match_superinstruction(code, i):
+    opcodes = [opcode for opcode, operand in code[i:i + 4]]
+    operands = [operand for opcode, operand in code[i:i + 4]]
+
+    if opcodes[:3] == [LOAD, LOAD, ADD]:
+        return (ADDVV, (operands[0], operands[1])), 3
+    elif opcodes[:2] == [LOAD, PUSH] and len(opcodes) == 4 and opcodes[2] in COMPARISONS and opcodes[3] == JE:
+        return (JCMPVK, (operands[0], operands[1], opcodes[2], operands[3])), 4
+    elif opcodes[:2] == [PUSH, SAVE]:
+        return (SAVEK, (operands[0], operands[1])), 2
+    elif opcodes[:2] == [PRINT, POP]:
+        return (PRINTPOP, None), 2
+    else:
+        return code[i], 1
+
+def fuse(image):
+    code = image.code
+
+    # A superinstruction can only be entered at its first instruction.
+    targets = set([0])
+    for i, (opcode, operand) in enumerate(code):
+        if opcode in JUMP_OPERANDS:
+            targets.add(operand)
+        if opcode == CALL:
+            targets.add(i + 1)
+
+    fused = []
+    addresses = []
+    mapping = {}
+    fusions = {}
+
+    i = 0
+    while i < len(code):
+        instruction, size = match_superinstruction(code, i)
+
+        if size > 1 and targets.intersection(range(i + 1, i + size)):
+            instruction, size = code[i], 1
+
+        if size > 1:
+            name = NAMES[instruction[0]]
+            fusions[name] = fusions.get(name, 0) + 1
+
+        mapping[i] = len(fused)
+        fused.append(instruction)
+        addresses.append(image.addresses[i])
+
+        i += size
+
+    # Jump targets are always the start of an instruction, so remap them to the fused stream.
+    for i, (opcode, operand) in enumerate(fused):
+        if opcode in JUMP_OPERANDS:
+            fused[i] = (opcode, mapping[operand])
+        elif opcode == JCMPVK:
+            fused[i] = (opcode, operand[:3] + (mapping[operand[3]],))
+
+    return Image(fused, image.data, addresses, image.variables, fusions, image.symbols)
+
+# The change in the depth of the stack made by each instruction, except CALL, RET and HALT.
+STACK_EFFECTS = {
+    NOP: 0, LOAD: 1, SAVE: -1, LOADL: 1, SAVEL: -1, PUSH: 1, POP: -1, DUP: 1,
+    JMP: 0, JLT: -1, JLTE: -1, JE: -1, JNE: -1, JGTE: -1, JGT: -1, ENTER: 0, LEAVE: 0,
+    CMPLT: -1, CMPLTE: -1, CMPE: -1, CMPNE: -1, CMPGTE: -1, CMPGT: -1,
+    MUL: -1, DIV: -1, ADD: -1, SUB: -1, PRINT: 0, DEBUG: 0, MARK: 0,
+    ADDVV: 1, JCMPVK: 0, SAVEK: 0, PRINTPOP: -1,
+}
+
+def stack_bound(image):
+    # The most values the stack holds while the image runs from its start, or
+    # None if there is no bound, because of recursion or a loop which pushes.
+    bounds = {}
+
+    def bound(entry, active):
+        if entry in active:
+            return None
+
+        if entry not in bounds:
+            depths = {entry: 0}
+            pending = [entry]
+            peak = 0
+
+            while pending:
+                pc = pending.pop()
+                opcode, operand = image.code[pc]
+                depth = depths[pc]
+
+                if opcode == CALL:
+                    # The return address is pushed, and popped by the callee's RET.
+                    inner = bound(operand, active | set([entry]))
+
+                    if inner is None:
+                        return None
+
+                    peak = max(peak, depth + 1 + inner)
+                    targets = [pc + 1]
+                elif opcode in (RET, HALT):
+                    targets = []
+                elif opcode == JMP:
+                    targets = [operand]
+                elif opcode == JCMPVK:
+                    targets = [operand[3], pc + 1]
+                elif opcode in JUMP_OPERANDS:
+                    targets = [operand, pc + 1]
+                else:
+                    targets = [pc + 1]
+
+                if opcode != CALL:
+                    depth += STACK_EFFECTS.get(opcode, 0)
+                    peak = max(peak, depth)
+
+                for target in targets:
+                    if target >= len(image.code):
+                        continue
+
+                    if target not in depths:
+                        depths[target] = depth
+                        pending.append(target)
+                    elif depth > depths[target]:
+                        return None
+
+            bounds[entry] = peak
+
+        return bounds[entry]
+
+    return bound(image.index.get(0, 0), set())
+
+class Profile:
+    """
+    Execution counts per instruction of an image, and the wall time of every
+    interval'th step, accumulated per opcode. See Machine.run_profiled().
+    """
+
+    INTERVAL = 64
+
+    def __init__(self, image, interval = None):
+        self.image = image
+        self.interval = interval or self.INTERVAL
+
+        self.counts = [0] * len(image.code)
+        self.samples = [0.0] * (max(NAMES) + 1)
+
+    def steps(self):
+        return sum(self.counts)
+
+    def opcodes(self):
+        # The count and estimated time of each opcode, by name.
+        opcodes = {}
+
+        for (opcode, operand), count in zip(self.image.code, self.counts):
+            if count:
+                entry = opcodes.setdefault(NAMES[opcode], {'count': 0})
+                entry['count'] += count
+
+        for name, entry in opcodes.iteritems():
+            entry['time'] = self.samples[OPCODES[name]] * self.interval
+
+        return opcodes
+
+    def addresses(self):
+        # The count of each executed instruction, by sequence offset.
+        return dict((address, count) for address, count in zip(self.image.addresses, self.counts) if count)
+
+    def as_dict(self):
+        return {
+            'steps': self.steps(),
+            'interval': self.interval,
+            'opcodes': self.opcodes(),
+            'addresses': self.addresses(),
+        }
+
+    def dump(self, stream):
+        json.dump(self.as_dict(), stream, indent = 2, sort_keys = True)
+        stream.write("\n")
+
+class History:
+    """
+    The last size steps executed by Machine.run_recorded(), as the
+    instruction index, the opcode and the top of the stack before each
+    step. The entries are preallocated lists which are written in a ring,
+    so recording doesn't allocate.
+    """
+
+    SIZE = 32
+
+    def __init__(self, image, size = None):
+        self.image = image
+        self.size = size or self.SIZE
+
+        self.indices = [0] * self.size
+        self.opcodes = [0] * self.size
+        self.tops = [None] * self.size
+
+        # The next entry to be written, and whether the ring has been filled.
+        self.position = 0
+        self.full = False
+
+    def entries(self):
+        # (offset, opcode name, top of stack), oldest first.
+        if self.full:
+            order = range(self.position, self.size) + range(self.position)
+        else:
+            order = range(self.position)
+
+        return [(self.image.addresses[self.indices[i]], NAMES[self.opcodes[i]], self.tops[i]) for i in order]
+
+    def dump(self, stream):
+        stream.write("-- Execution History --\n")
+
+        for offset, name, top in self.entries():
+            stream.write("%6d: %-8s %r\n" % (offset, name, top))
+
+class Frames:
+    """
+    The activation records of procedures. Records are allocated in stack
+    order from a preallocated list of words, which only grows when calls
+    nest deeper than they have before, so calls don't allocate. Each record
+    holds the offset of the record of the enclosing procedure (the static
+    link), the offset of the caller's record (the dynamic link) and then the
+    locals. The main program has an empty record at offset 0, and globals
+    are kept in the data segment instead.
+    """
+
+    SIZE = 1024
+
+    def __init__(self, size = None):
+        self.memory = [0] * (size or self.SIZE)
+        self.fp = 0
+        self.top = 2
+
+    def frame(self, depth):
+        # Follow depth static links from the current record.
+        memory = self.memory
+        fp = self.fp
+
+        for i in xrange(depth):
+            fp = memory[fp]
+
+        return fp
+
+    def address(self, depth, slot):
+        return self.frame(depth) + 2 + slot
+
+    def enter(self, depth, size):
+        memory = self.memory
+        fp = self.top
+        top = fp + 2 + size
+
+        if top > len(memory):
+            memory.extend([0] * max(top, len(memory)))
+
+        memory[fp] = self.frame(depth)
+        memory[fp + 1] = self.fp
+
+        for i in xrange(fp + 2, top):
+            memory[i] = 0
+
+        self.fp = fp
+        self.top = top
+
+    def leave(self):
+        self.top = self.fp
+        self.fp = self.memory[self.fp + 1]
+
+    def contents(self):
+        return self.memory[:self.top]
+
+    @classmethod
+    def from_contents(cls, contents, fp):
+        frames = cls(max(len(contents), cls.SIZE))
+        frames.memory[:len(contents)] = contents
+        frames.fp = fp
+        frames.top = len(contents)
+        return frames
+
+def flushing(run):
+    # Printed values are written out whenever a run stops, including by an exception.
+    def method(self, *arguments):
+        try:
+            return run(self, *arguments)
+        finally:
+            self.output.flush()
+
+    method.__name__ = run.__name__
+    method.__doc__ = run.__doc__
+    return method
+
 class Machine:
-    def __init__(self, sequence):
+    def __init__(self, sequence, output = None):
         self.offset = 0
         self.sequence = sequence
         self.stack = []
 
+        # Where PRINT writes values, see pl0_output.
+        self.output = output or pl0_output.Output()
+
+        # The number of steps executed by runs with a step budget.
+        self.steps = 0
+
+        # The decoded form used by run_fast(), see load().
+        self.image = None
+        self.data = None
+        self.tracer = None
+        self.profile = None
+        self.history = None
+
+        # The activation records of procedures with locals.
+        self.frames = Frames()
+
+    @classmethod
+    def from_image(cls, image):
+        # A machine without a sequence, which can only run the image.
+        machine = cls(None)
+        machine.load(image)
+        return machine
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        machine = cls(None)
+        machine.restore(snapshot)
+        return machine
+
+    def snapshot(self):
+        # The complete state of the machine as a compact string, see restore().
+        image = self.image
+        data = self.data
+
+        if image is not None:
+            image = (image.code, image.data, image.addresses, image.variables, image.fusions, image.symbols)
+            data = list(data)
+
+        state = (SNAPSHOT_VERSION, self.sequence, image, data, self.stack_contents(),
+            self.offset, self.steps, self.frames.contents(), self.frames.fp)
+
+        return marshal.dumps(state)
+
+    def restore(self, snapshot):
+        state = marshal.loads(snapshot)
+
+        if state[0] != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version %r" % state[0])
+
+        version, self.sequence, image, self.data, self.stack, self.offset, self.steps, frames, fp = state
+
+        if image is not None:
+            self.image = Image(*image)
+        else:
+            self.image = None
+
+        self.frames = Frames.from_contents(frames, fp)
+
     def step(self):
         instruction = NAMES[self.sequence[self.offset]]
 
@@ -85,16 +580,309 @@ class Machine:
 
         return self.offset >= 0 and self.offset < len(self.sequence)
 
-    def run(self):
-        result = True
-        while result:
-            result = self.step()
+    def halted(self):
+        if self.sequence is None:
+            return self.offset == -1
+
+        return not 0 <= self.offset < len(self.sequence)
+
+    @flushing
+    def run(self, max_steps = None):
+        # Runs until the program halts, or suspends after max_steps steps. Calling run() again resumes it.
+        if self.sequence is None:
+            return self.run_fast(max_steps)
+
+        if self.halted():
+            return HALTED
+
+        if max_steps is None:
+            result = True
+            while result:
+                result = self.step()
+
+            return HALTED
+
+        for i in xrange(max_steps):
+            if not self.step():
+                self.steps += i + 1
+                return HALTED
+
+        self.steps += max_steps
+        return SUSPENDED
+
+    def load(self, image = None):
+        # Decode the sequence, unless an image of it has already been decoded.
+        if image is None:
+            image = fuse(decode(self.sequence))
+
+        self.image = image
+        self.data = list(image.data)
+
+    def dispatch_table(self):
+        # Resolve every opcode to its bound handler once, indexed by opcode.
+        table = [None] * (max(NAMES) + 1)
+
+        for opcode, name in NAMES.iteritems():
+            table[opcode] = getattr(self, "execute_%s" % name.lower())
+
+        return table
+
+    @flushing
+    def run_fast(self, max_steps = None):
+        # Equivalent to run(), but executes the decoded image without
+        # per-step name formatting, getattr or operand fetches.
+        if self.image is None:
+            self.load()
+
+        if self.offset == -1:
+            return HALTED
+
+        table = self.dispatch_table()
+        code = self.image.code
+        pc = self.image.index[self.offset]
+
+        if max_steps is None:
+            while pc >= 0:
+                opcode, operand = code[pc]
+                pc = table[opcode](operand, pc)
+        else:
+            # A separate loop, so that unbudgeted runs don't pay for counting.
+            remaining = max_steps
+            while pc >= 0 and remaining:
+                opcode, operand = code[pc]
+                pc = table[opcode](operand, pc)
+                remaining -= 1
+
+            self.steps += max_steps - remaining
+
+        self.update_offset(pc)
+
+        if pc < 0:
+            return HALTED
+        else:
+            return SUSPENDED
+
+    @flushing
+    def run_budgeted(self, budget):
+        # Equivalent to run_fast(), but checks the budget, see pl0_budget,
+        # before every backward jump and call. These are found once and
+        # replaced in a copy of the code by a checking instruction, so
+        # other instructions, and forward jumps, run at full speed.
+        if self.image is None:
+            self.load()
+
+        if self.offset == -1:
+            return HALTED
+
+        table = self.dispatch_table()
+        code = list(self.image.code)
+
+        for i, (opcode, operand) in enumerate(code):
+            if opcode == JCMPVK:
+                target = operand[3]
+            elif opcode in JUMP_OPERANDS:
+                target = operand
+            else:
+                continue
+
+            if opcode == CALL or target <= i:
+                code[i] = (len(table), (opcode, operand))
+
+        check = budget.check
+
+        def execute_checked(operand, pc):
+            # The machine stops before the jump, so it can be inspected or resumed.
+            try:
+                check(self)
+            except:
+                self.update_offset(pc)
+                raise
+
+            opcode, operand = operand
+            return table[opcode](operand, pc)
+
+        table.append(execute_checked)
+
+        pc = self.image.index[self.offset]
+        budget.start()
+
+        while pc >= 0:
+            opcode, operand = code[pc]
+            pc = table[opcode](operand, pc)
+
+        self.update_offset(pc)
+
+        return HALTED
+
+    def stack_depth(self):
+        # Words in use on the operand stack and by activation records.
+        return len(self.stack) + self.frames.top
+
+    @flushing
+    def run_to_marker(self):
+        # Equivalent to run_fast(), but stops before the next MARK instruction.
+        if self.image is None:
+            self.load()
+
+        if self.offset == -1:
+            return HALTED
+
+        table = self.dispatch_table()
+        code = self.image.code
+        pc = self.image.index[self.offset]
+
+        # Resuming from a marker continues past it.
+        if code[pc][0] == MARK:
+            pc += 1
+
+        while pc >= 0:
+            opcode, operand = code[pc]
+
+            if opcode == MARK:
+                break
+
+            pc = table[opcode](operand, pc)
+
+        self.update_offset(pc)
+
+        if pc < 0:
+            return HALTED
+        else:
+            return SUSPENDED
+
+    @flushing
+    def run_profiled(self, interval = None):
+        # Equivalent to run_fast(), but counts every step and times a sample of them into self.profile.
+        # This is a separate loop, so that run_fast() doesn't pay for profiling.
+        if self.image is None:
+            self.load()
+
+        self.profile = profile = Profile(self.image, interval)
+
+        if self.offset == -1:
+            return HALTED
+
+        table = self.dispatch_table()
+        code = self.image.code
+        counts = profile.counts
+        samples = profile.samples
+        interval = profile.interval
+        clock = time.time
+
+        pc = self.image.index[self.offset]
+        countdown = interval
+
+        while pc >= 0:
+            counts[pc] += 1
+            opcode, operand = code[pc]
+
+            countdown -= 1
+            if countdown:
+                pc = table[opcode](operand, pc)
+            else:
+                start = clock()
+                pc = table[opcode](operand, pc)
+                samples[opcode] += clock() - start
+                countdown = interval
+
+        self.update_offset(pc)
+
+        return HALTED
+
+    @flushing
+    def run_recorded(self, size = None):
+        # Equivalent to run_fast(), but keeps the last steps in self.history,
+        # which is written to stderr if the program faults. This is a separate
+        # loop, so that run_fast() doesn't pay for recording.
+        if self.image is None:
+            self.load()
+
+        self.history = history = History(self.image, size)
+
+        if self.offset == -1:
+            return HALTED
+
+        table = self.dispatch_table()
+        code = self.image.code
+        indices = history.indices
+        opcodes = history.opcodes
+        tops = history.tops
+        size = history.size
+        top = self.top_of_stack
+
+        pc = self.image.index[self.offset]
+        position = 0
+
+        try:
+            while pc >= 0:
+                opcode, operand = code[pc]
+
+                indices[position] = pc
+                opcodes[position] = opcode
+                tops[position] = top()
+
+                position += 1
+                if position == size:
+                    position = 0
+                    history.full = True
+
+                pc = table[opcode](operand, pc)
+        except Exception:
+            history.position = position
+            self.update_offset(pc)
+            self.output.flush()
+            history.dump(sys.stderr)
+            raise
+
+        history.position = position
+        self.update_offset(pc)
+
+        return HALTED
+
+    @flushing
+    def run_compiled(self):
+        # Equivalent to run(), but executes the image as Python code, see pl0_block_compiler.
+        import pl0_block_compiler
+
+        if self.image is None:
+            self.load()
+
+        def debug(offset):
+            self.offset = offset
+            self.debug()
+
+        program = pl0_block_compiler.compile_image(self.image, self.stack_limit())
+        pc = self.call_translated(program, self.image.index[self.offset], debug, self.frames, self.output.write)
+
+        self.update_offset(pc)
+
+    @flushing
+    def run_traced(self, threshold = None):
+        # Equivalent to run_fast(), but hot loops are recorded and replaced
+        # by specialized Python code, see pl0_tracer.
+        import pl0_tracer
+
+        if self.image is None:
+            self.load()
+
+        self.tracer = pl0_tracer.Tracer(self, threshold)
+        pc = self.tracer.run(self.image.index[self.offset])
+
+        self.update_offset(pc)
+
+    def update_offset(self, pc):
+        # Map an instruction index of the image back to a sequence offset.
+        if pc == -1:
+            self.offset = -1
+        else:
+            self.offset = self.image.addresses[pc]
 
     def instruction_nop(self):
         self.offset += 1
 
     def instruction_halt(self):
         self.offset = -1
+        self.output.flush()
 
     # Basic absolute address load/save unit
     def instruction_load(self):
@@ -137,6 +925,26 @@ class Machine:
     def instruction_ret(self):
         address = self.stack.pop()
         self.offset = address
+
+    # Activation records
+    def instruction_enter(self):
+        depth, size = self.sequence[self.offset + 1:self.offset + 3]
+        self.frames.enter(depth, size)
+        self.offset += 3
+
+    def instruction_leave(self):
+        self.frames.leave()
+        self.offset += 1
+
+    def instruction_loadl(self):
+        depth, slot = self.sequence[self.offset + 1:self.offset + 3]
+        self.stack.append(self.frames.memory[self.frames.address(depth, slot)])
+        self.offset += 3
+
+    def instruction_savel(self):
+        depth, slot = self.sequence[self.offset + 1:self.offset + 3]
+        self.frames.memory[self.frames.address(depth, slot)] = self.stack.pop()
+        self.offset += 3
 
     # Jump based on the result of a subtraction
     def instruction_jlt(self):
@@ -249,21 +1057,546 @@ class Machine:
 
     def instruction_print(self):
         self.offset += 1
-        print self.stack[-1]
+        self.output.write(self.stack[-1])
 
     def instruction_debug(self):
         self.offset += 1
         self.debug()
 
+    def instruction_mark(self):
+        self.offset += 1
+
+    # Pre-decoded instruction handlers, which take the operand and the
+    # current instruction index and return the next instruction index.
+    def execute_nop(self, operand, pc):
+        return pc + 1
+
+    def execute_halt(self, operand, pc):
+        self.output.flush()
+        return -1
+
+    def execute_load(self, address, pc):
+        self.stack.append(self.data[address])
+        return pc + 1
+
+    def execute_save(self, address, pc):
+        self.data[address] = self.stack.pop()
+        return pc + 1
+
+    def execute_push(self, value, pc):
+        self.stack.append(value)
+        return pc + 1
+
+    def execute_pop(self, operand, pc):
+        self.stack.pop()
+        return pc + 1
+
+    def execute_dup(self, operand, pc):
+        self.stack.append(self.stack[-1])
+        return pc + 1
+
+    def execute_jmp(self, address, pc):
+        return address
+
+    def execute_call(self, address, pc):
+        self.stack.append(self.image.addresses[pc + 1])
+        return address
+
+    def execute_ret(self, operand, pc):
+        return self.image.index[self.stack.pop()]
+
+    def execute_enter(self, operand, pc):
+        self.frames.enter(*operand)
+        return pc + 1
+
+    def execute_leave(self, operand, pc):
+        self.frames.leave()
+        return pc + 1
+
+    def execute_loadl(self, operand, pc):
+        depth, slot = operand
+        frames = self.frames
+
+        if depth:
+            self.stack.append(frames.memory[frames.address(depth, slot)])
+        else:
+            self.stack.append(frames.memory[frames.fp + 2 + slot])
+
+        return pc + 1
+
+    def execute_savel(self, operand, pc):
+        depth, slot = operand
+        frames = self.frames
+
+        if depth:
+            frames.memory[frames.address(depth, slot)] = self.stack.pop()
+        else:
+            frames.memory[frames.fp + 2 + slot] = self.stack.pop()
+
+        return pc + 1
+
+    def execute_jlt(self, address, pc):
+        if self.stack.pop() > 0:
+            return address
+        return pc + 1
+
+    def execute_jlte(self, address, pc):
+        if self.stack.pop() >= 0:
+            return address
+        return pc + 1
+
+    def execute_je(self, address, pc):
+        if self.stack.pop() == 0:
+            return address
+        return pc + 1
+
+    def execute_jne(self, address, pc):
+        if self.stack.pop() != 0:
+            return address
+        return pc + 1
+
+    def execute_jgte(self, address, pc):
+        if self.stack.pop() <= 0:
+            return address
+        return pc + 1
+
+    def execute_jgt(self, address, pc):
+        if self.stack.pop() < 0:
+            return address
+        return pc + 1
+
+    def execute_cmplt(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] < b)
+        return pc + 1
+
+    def execute_cmplte(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] <= b)
+        return pc + 1
+
+    def execute_cmpe(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] == b)
+        return pc + 1
+
+    def execute_cmpne(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] != b)
+        return pc + 1
+
+    def execute_cmpgt(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] > b)
+        return pc + 1
+
+    def execute_cmpgte(self, operand, pc):
+        b = self.stack.pop()
+        self.stack[-1] = int(self.stack[-1] >= b)
+        return pc + 1
+
+    def execute_mul(self, operand, pc):
+        self.stack.append(self.stack.pop() * self.stack.pop())
+        return pc + 1
+
+    def execute_div(self, operand, pc):
+        self.stack.append(self.stack.pop() / self.stack.pop())
+        return pc + 1
+
+    def execute_add(self, operand, pc):
+        self.stack.append(self.stack.pop() + self.stack.pop())
+        return pc + 1
+
+    def execute_sub(self, operand, pc):
+        self.stack.append(self.stack.pop() - self.stack.pop())
+        return pc + 1
+
+    def execute_print(self, operand, pc):
+        self.output.write(self.stack[-1])
+        return pc + 1
+
+    def execute_debug(self, operand, pc):
+        self.offset = self.image.addresses[pc + 1]
+        self.debug()
+        return pc + 1
+
+    def execute_mark(self, operand, pc):
+        return pc + 1
+
+    # LOAD a; LOAD b; ADD
+    def execute_addvv(self, operand, pc):
+        a, b = operand
+        self.stack.append(self.data[b] + self.data[a])
+        return pc + 1
+
+    # LOAD x; PUSH k; CMPxx; JE address
+    def execute_jcmpvk(self, operand, pc):
+        x, k, comparison, address = operand
+        if COMPARISONS[comparison](self.data[x], k):
+            return pc + 1
+        return address
+
+    # PUSH k; SAVE x
+    def execute_savek(self, operand, pc):
+        k, x = operand
+        self.data[x] = k
+        return pc + 1
+
+    # PRINT; POP
+    def execute_printpop(self, operand, pc):
+        self.output.write(self.stack.pop())
+        return pc + 1
+
     def debug(self):
+        self.output.flush()
+
         print "-- Machine State --"
         print "Sequence: " + `self.sequence`
-        print "Stack: " + `self.stack`
+
+        if self.image is not None:
+            print "Data: " + `list(self.data)`
+            print "Fusions: " + `self.image.fusions`
+
+        if self.tracer is not None:
+            print "Traces: " + `self.tracer.statistics()`
+
+        print "Stack: " + `self.stack_contents()`
         print "Offset: " + `self.offset`
+
+    def stack_contents(self):
+        return self.stack
+
+    def stack_limit(self):
+        # The most values the stack can hold, or None if it only grows, see FixedMachine.
+        return None
+
+    def call_translated(self, function, *arguments):
+        # Runs code from pl0_block_compiler or pl0_tracer, which takes the data and stack first.
+        return function(self.data, self.stack, *arguments)
+
+    def top_of_stack(self):
+        if self.stack:
+            return self.stack[-1]
+
+# Signed 64-bit integers. The 'q' type code needs Python 3.3, but 'l' is 64 bits wide on most 64-bit platforms.
+try:
+    TYPECODE = array.array('q').typecode
+except ValueError:
+    TYPECODE = 'l'
+
+SIGN = 1 << 63
+MASK = (1 << 64) - 1
+
+def wrap(value):
+    # Wrap around like a 64-bit two's complement integer.
+    return ((value + SIGN) & MASK) - SIGN
+
+class StackOverflowError(Exception):
+    pass
+
+class FixedMachine(Machine):
+    """
+    A machine with a fixed-width memory model: the data segment and the
+    stack are preallocated arrays of signed 64-bit integers, with an
+    explicit stack pointer. Arithmetic wraps around, and pushing beyond
+    the maximum depth raises StackOverflowError.
+
+    Unless a depth is given, the stack is sized to the most the program
+    can use, see stack_bound(), or to DEPTH if that isn't bounded.
+    """
+
+    DEPTH = 256
+
+    def __init__(self, sequence, depth = None, output = None):
+        Machine.__init__(self, sequence, output)
+
+        self.depth = depth
+        self.stack = array.array(TYPECODE)
+        self.sp = 0
+
+    def allocate(self, contents = ()):
+        if self.depth is None:
+            bound = self.image and stack_bound(self.image)
+            self.depth = self.DEPTH if bound is None else bound
+
+        if len(contents) > self.depth:
+            raise StackOverflowError("Stack depth of %d exceeded" % self.depth)
+
+        self.stack = array.array(TYPECODE, [0]) * self.depth
+        self.stack[:len(contents)] = array.array(TYPECODE, contents)
+        self.sp = len(contents)
+
+    def load(self, image = None):
+        Machine.load(self, image)
+        self.data = array.array(TYPECODE, [wrap(value) for value in self.image.data])
+        self.allocate()
+
+    def restore(self, snapshot):
+        Machine.restore(self, snapshot)
+
+        self.allocate(self.stack)
+
+        if self.data is not None:
+            self.data = array.array(TYPECODE, self.data)
+
+    def run(self, max_steps = None):
+        return self.run_fast(max_steps)
+
+    def checked(self, run, *arguments):
+        # Overflow is detected by the array bounds check, so pushes don't test the depth.
+        try:
+            return run(self, *arguments)
+        except IndexError:
+            if self.sp >= self.depth:
+                raise StackOverflowError("Stack depth of %d exceeded" % self.depth)
+            raise
+
+    def run_fast(self, max_steps = None):
+        return self.checked(Machine.run_fast, max_steps)
+
+    def run_budgeted(self, budget):
+        return self.checked(Machine.run_budgeted, budget)
+
+    def run_traced(self, threshold = None):
+        return self.checked(Machine.run_traced, threshold)
+
+    def stack_depth(self):
+        return self.sp + self.frames.top
+
+    def stack_limit(self):
+        return self.depth
+
+    def call_translated(self, function, *arguments):
+        # Translated code works on lists, so it is given copies which are copied back.
+        data = self.data.tolist()
+        stack = self.stack_contents()
+
+        try:
+            return function(data, stack, *arguments)
+        finally:
+            self.data = array.array(TYPECODE, data)
+            self.allocate(stack[:self.depth])
+
+    def stack_contents(self):
+        return self.stack[:self.sp].tolist()
+
+    def top_of_stack(self):
+        if self.sp:
+            return self.stack[self.sp - 1]
+
+    def push(self, value):
+        self.stack[self.sp] = value
+        self.sp += 1
+
+    def pop(self):
+        if self.sp == 0:
+            raise IndexError("pop from empty stack")
+
+        self.sp -= 1
+        return self.stack[self.sp]
+
+    # The handlers below inline push() and pop(), which are too slow to call on every step.
+    # Results outside 64 bits don't fit the array, and are wrapped around when that fails.
+
+    def underflow(self):
+        raise IndexError("pop from empty stack")
+
+    def execute_load(self, address, pc):
+        sp = self.sp
+        self.stack[sp] = self.data[address]
+        self.sp = sp + 1
+        return pc + 1
+
+    def execute_save(self, address, pc):
+        sp = self.sp - 1
+        if sp < 0:
+            self.underflow()
+
+        self.data[address] = self.stack[sp]
+        self.sp = sp
+        return pc + 1
+
+    def execute_loadl(self, operand, pc):
+        frames = self.frames
+        sp = self.sp
+        self.stack[sp] = frames.memory[frames.address(*operand)]
+        self.sp = sp + 1
+        return pc + 1
+
+    def execute_savel(self, operand, pc):
+        frames = self.frames
+        sp = self.sp - 1
+        if sp < 0:
+            self.underflow()
+
+        frames.memory[frames.address(*operand)] = self.stack[sp]
+        self.sp = sp
+        return pc + 1
+
+    def execute_push(self, value, pc):
+        sp = self.sp
+        try:
+            self.stack[sp] = value
+        except OverflowError:
+            self.stack[sp] = wrap(value)
+        self.sp = sp + 1
+        return pc + 1
+
+    def execute_pop(self, operand, pc):
+        if self.sp == 0:
+            self.underflow()
+
+        self.sp -= 1
+        return pc + 1
+
+    def execute_dup(self, operand, pc):
+        stack = self.stack
+        sp = self.sp
+        if sp == 0:
+            self.underflow()
+
+        stack[sp] = stack[sp - 1]
+        self.sp = sp + 1
+        return pc + 1
+
+    def execute_call(self, address, pc):
+        sp = self.sp
+        self.stack[sp] = self.image.addresses[pc + 1]
+        self.sp = sp + 1
+        return address
+
+    def execute_ret(self, operand, pc):
+        sp = self.sp - 1
+        if sp < 0:
+            self.underflow()
+
+        self.sp = sp
+        return self.image.index[self.stack[sp]]
+
+    def execute_conditional(self, address, pc):
+        sp = self.sp - 1
+        if sp < 0:
+            self.underflow()
+
+        self.sp = sp
+        if CONDITIONS[self.image.code[pc][0]](self.stack[sp]):
+            return address
+        return pc + 1
+
+    execute_jlt = execute_jlte = execute_je = execute_conditional
+    execute_jne = execute_jgte = execute_jgt = execute_conditional
+
+    def execute_comparison(self, operand, pc):
+        stack = self.stack
+        sp = self.sp - 2
+        if sp < 0:
+            self.underflow()
+
+        stack[sp] = COMPARISONS[self.image.code[pc][0]](stack[sp], stack[sp + 1])
+        self.sp = sp + 1
+        return pc + 1
+
+    execute_cmplt = execute_cmplte = execute_cmpe = execute_comparison
+    execute_cmpne = execute_cmpgte = execute_cmpgt = execute_comparison
+
+    def arithmetic(operation):
+        # Like Machine, the top of the stack is combined with the value below it.
+        def execute(self, operand, pc):
+            stack = self.stack
+            sp = self.sp - 2
+            if sp < 0:
+                self.underflow()
+
+            value = operation(stack[sp + 1], stack[sp])
+            try:
+                stack[sp] = value
+            except OverflowError:
+                stack[sp] = wrap(value)
+            self.sp = sp + 1
+            return pc + 1
+
+        return execute
+
+    execute_mul = arithmetic(operator.mul)
+    execute_div = arithmetic(operator.div)
+    execute_add = arithmetic(operator.add)
+    execute_sub = arithmetic(operator.sub)
+
+    del arithmetic
+
+    def execute_print(self, operand, pc):
+        if self.sp == 0:
+            self.underflow()
+
+        self.output.write(self.stack[self.sp - 1])
+        return pc + 1
+
+    def execute_addvv(self, operand, pc):
+        a, b = operand
+        sp = self.sp
+        value = self.data[b] + self.data[a]
+        try:
+            self.stack[sp] = value
+        except OverflowError:
+            self.stack[sp] = wrap(value)
+        self.sp = sp + 1
+        return pc + 1
+
+    def execute_savek(self, operand, pc):
+        k, x = operand
+        self.data[x] = wrap(k)
+        return pc + 1
+
+    def execute_printpop(self, operand, pc):
+        sp = self.sp - 1
+        if sp < 0:
+            self.underflow()
+
+        self.sp = sp
+        self.output.write(self.stack[sp])
+        return pc + 1
 
 if __name__ == '__main__':
-    buffer = sys.stdin.read()
-    code = eval(buffer)
-    machine = Machine(code)
-    machine.run()
+    import pl0_bytecode
+    import pl0_budget
+
+    paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+
+    if '--fixed' in sys.argv:
+        machine_class = FixedMachine
+    else:
+        machine_class = Machine
+
+    if paths and paths[0].endswith('.pl0'):
+        # Source, which is compiled and assembled in this process.
+        import pl0_compiler
+        machine = machine_class(pl0_compiler.compile_source(open(paths[0]).read(), '--optimize' in sys.argv))
+    elif paths:
+        # A binary image written by pl0_assembler.py --binary.
+        machine = machine_class.from_image(fuse(pl0_bytecode.load_image(paths[0])))
+    else:
+        code = ast.literal_eval(sys.stdin.read())
+        machine = machine_class(code)
+
+    budget = pl0_budget.parse_arguments(sys.argv[1:])
+
+    if budget is not None:
+        machine.run_budgeted(budget)
+    elif '--fast' in sys.argv:
+        machine.run_fast()
+    elif '--profile' in sys.argv:
+        machine.run_profiled()
+    elif '--history' in sys.argv:
+        machine.run_recorded()
+    elif '--compiled' in sys.argv:
+        machine.run_compiled()
+    elif '--traced' in sys.argv:
+        machine.run_traced()
+    else:
+        machine.run()
+
     machine.debug()
+
+    if machine.profile is not None:
+        # Written separately from the program's output.
+        machine.profile.dump(sys.stderr)
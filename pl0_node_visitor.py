@@ -62,7 +62,7 @@ class NodeVisitor(object):
         results = []
 
         for expr in expressions:
-            if type(expr) in [list, tuple]:
+            if isinstance(expr, (list, tuple)):
                 result = self.visit_node(expr)
                 results.append(result)
 
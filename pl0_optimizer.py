@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import pprint
+import pl0_parser
+from pl0_node_visitor import StackingNodeVisitor
+
+# Comparisons which are folded when both sides are constant. The equality
+# comparisons are left to the backends, which do not agree on them.
+COMPARISONS = {
+    'LT': lambda lhs, rhs: lhs < rhs,
+    'LTE': lambda lhs, rhs: lhs <= rhs,
+    'GT': lambda lhs, rhs: lhs > rhs,
+    'GTE': lambda lhs, rhs: lhs >= rhs,
+}
+
+def number(value):
+    return ('NUMBER', value)
+
+def expression(value):
+    return ['EXPRESSION', None, ['TERM', number(value)]]
+
+def constant(node):
+    # The value of a number, or of an expression or term which is just a number.
+    while node[0] in ('EXPRESSION', 'TERM'):
+        if node[0] == 'EXPRESSION' and (node[1] is not None or len(node) != 3):
+            return None
+        if node[0] == 'TERM' and len(node) != 2:
+            return None
+
+        node = node[-1]
+
+    if node[0] == 'NUMBER':
+        return node[1]
+
+def factors(term):
+    # The factors of a term which is only a product, otherwise None.
+    if any(operator != 'TIMES' for operator, factor in term[2:]):
+        return None
+
+    return [term[1]] + [factor for operator, factor in term[2:]]
+
+def product(items):
+    return ['TERM', items[0]] + [('TIMES', factor) for factor in items[1:]]
+
+def declarations(node, counts):
+    # Counts the blocks which declare each name.
+    if node[0] == 'BLOCK':
+        for section in node[1:4]:
+            for declaration in (section or [])[1:]:
+                counts[declaration[1]] = counts.get(declaration[1], 0) + 1
+
+    for child in node[1:]:
+        if isinstance(child, (list, tuple)):
+            declarations(child, counts)
+
+    return counts
+
+def writes(node, names):
+    # Adds the variables a statement may assign to names, or returns None if it calls a procedure.
+    if node is None or node[0] in ('EXPRESSION', 'CONDITION', 'ODD', 'PRINT'):
+        return names
+
+    if node[0] == 'CALL':
+        return None
+
+    if node[0] == 'SET':
+        names.add(node[1][1])
+        return names
+
+    for child in node[1:]:
+        if isinstance(child, (list, tuple)) and writes(child, names) is None:
+            return None
+
+    return names
+
+class Optimizer(StackingNodeVisitor):
+    """
+    Rewrites the syntax tree into an equivalent one with less work left for
+    the backend, so it can run in front of any of them. Constants are
+    inlined, constant subexpressions are folded, and x + 0, x * 1 and x * 0
+    are simplified. Within straight-line code a variable assigned a
+    constant is replaced by that constant until it is assigned again, a
+    loop which may assign it is entered, or a procedure is called.
+    Branches and loops with constant conditions are removed or inlined.
+
+    Names are resolved lexically, as the compiler does. The interpreter and
+    the closure compiler resolve them dynamically instead, so for those a
+    constant is only inlined if no other block declares its name, and the
+    same declaration is found either way. Terms which divide
+    are never reordered or folded, since the backends disagree on division,
+    and subtraction is folded as the language defines it. Nodes which are
+    unchanged are returned as they are, and rewritten ones take the line
+    of the node they replace, see pl0_parser.line_of().
+    """
+
+    def __init__(self, dynamic = False):
+        StackingNodeVisitor.__init__(self)
+
+        self.dynamic = dynamic
+
+        # The number of blocks which declare each name, if names are resolved dynamically.
+        self.declarations = {}
+
+        # The constant value of variables assigned in the current straight-line code.
+        self.known = {}
+
+    def optimize(self, program):
+        if self.dynamic:
+            self.declarations = declarations(program, {})
+
+        return self.visit_node(program)
+
+    def _invoke_method(self, meth, node):
+        # Unchanged nodes are returned, so they must be the nodes themselves.
+        return meth(node)
+
+    def rebuilt(self, node, result):
+        if result == node:
+            return node
+
+        line = pl0_parser.line_of(node)
+        if line is not None:
+            result = pl0_parser.locate(line, result)
+
+        return result
+
+    def kind(self, name):
+        try:
+            return self.find(name)[0]
+        except NameError:
+            return None
+
+    def accept_program(self, node):
+        return self.rebuilt(node, (node[0], self.visit_node(node[1])))
+
+    def accept_block(self, node):
+        nid, constants, variables, procedures, statement = node
+
+        self.push()
+
+        for var in (constants or [])[1:]:
+            self.stack[-1].define(var[1], var[2])
+
+        for var in (variables or [])[1:]:
+            self.stack[-1].update(var[1], None)
+
+        for proc in (procedures or [])[1:]:
+            self.stack[-1].declare(proc[1], None)
+
+        known = self.known
+
+        if procedures:
+            procedures = self.rebuilt(procedures, [procedures[0]] + [
+                self.rebuilt(proc, (proc[0], proc[1], self.visit_node(proc[2]))) for proc in procedures[1:]
+            ])
+
+        self.known = {}
+        statement = self.visit_node(statement)
+        self.known = known
+
+        self.pop()
+
+        return self.rebuilt(node, (nid, constants, variables, procedures, statement))
+
+    def accept_set(self, node):
+        nid, target, value = node
+        value = self.visit_node(value)
+
+        self.known.pop(target[1], None)
+
+        if self.kind(target[1]) == 'VARIABLE' and constant(value) is not None:
+            self.known[target[1]] = constant(value)
+
+        return self.rebuilt(node, (nid, target, value))
+
+    def accept_call(self, node):
+        # The procedure may assign any variable it can see.
+        self.known.clear()
+
+        return node
+
+    def accept_begin(self, node):
+        return self.rebuilt(node, [node[0]] + [self.visit_node(statement) for statement in node[1:]])
+
+    def accept_if(self, node):
+        nid, condition, body = node
+        condition = self.visit_node(condition)
+        truth = self.truth(condition)
+
+        if truth is False:
+            return self.rebuilt(node, ['BEGIN'])
+
+        known = dict(self.known)
+        body = self.visit_node(body)
+
+        if truth is True:
+            return body
+
+        # Only what is known on both paths is known afterwards.
+        self.known = dict((name, value) for name, value in known.items() if self.known.get(name) == value)
+
+        return self.rebuilt(node, (nid, condition, body))
+
+    def accept_while(self, node):
+        nid, condition, body = node
+
+        names = writes(body, set())
+        if names is None:
+            self.known.clear()
+
+        for name in names or ():
+            self.known.pop(name, None)
+
+        condition = self.visit_node(condition)
+
+        if self.truth(condition) is False:
+            return self.rebuilt(node, ['BEGIN'])
+
+        # Nothing the body assigns is known at the top of the loop, or after it.
+        known = dict(self.known)
+        body = self.visit_node(body)
+        self.known = known
+
+        return self.rebuilt(node, (nid, condition, body))
+
+    def accept_print(self, node):
+        return self.rebuilt(node, (node[0], self.visit_node(node[1])))
+
+    def accept_odd(self, node):
+        return self.rebuilt(node, (node[0], self.visit_node(node[1])))
+
+    def accept_condition(self, node):
+        nid, lhs, operator, rhs = node
+
+        return self.rebuilt(node, (nid, self.visit_node(lhs), operator, self.visit_node(rhs)))
+
+    def truth(self, condition):
+        # The value of a condition if it is constant, otherwise None.
+        if condition[0] == 'ODD':
+            value = constant(condition[1])
+
+            if value is not None:
+                return value % 2 != 0
+        elif condition[2] in COMPARISONS:
+            lhs, rhs = constant(condition[1]), constant(condition[3])
+
+            if lhs is not None and rhs is not None:
+                return COMPARISONS[condition[2]](lhs, rhs)
+
+    def accept_expression(self, node):
+        sign = -1 if node[1] == 'MINUS' else 1
+        total = 0
+        position = None
+        items = []
+
+        for operator, term in [('PLUS', node[2])] + list(node[3:]):
+            term = self.visit_node(term)
+            signs = sign * (-1 if operator == 'MINUS' else 1)
+            parts = [(signs, term)]
+
+            # Parentheses within a sum are flattened into it.
+            if len(term) == 2 and term[1][0] == 'EXPRESSION':
+                inner = term[1]
+                signs *= -1 if inner[1] == 'MINUS' else 1
+                parts = [(signs, inner[2])] + [(signs * (-1 if operator == 'MINUS' else 1), part) for operator, part in inner[3:]]
+
+            for signs, part in parts:
+                value = constant(part)
+
+                if value is None:
+                    items.append((signs, part))
+                else:
+                    total += signs * value
+
+                    if position is None:
+                        position = len(items)
+                        items.append(None)
+
+        if len(items) == 1 and position is not None:
+            return self.rebuilt(node, expression(total))
+
+        # Constants are added together in the place of the first one.
+        if position is not None and total:
+            items[position] = (1 if total > 0 else -1, ['TERM', number(abs(total))])
+        elif position is not None:
+            del items[position]
+
+        # Start with a term which is added, negating a constant factor to get one if need be.
+        first = [index for index, (signs, term) in enumerate(items) if signs > 0]
+        sign = None
+
+        if not first and self.negated(items[0][1]):
+            items[0] = (1, self.negated(items[0][1]))
+            first = [0]
+
+        if not first:
+            sign = 'MINUS'
+            items = [(-signs, term) for signs, term in items]
+            first = [0]
+
+        items.insert(0, items.pop(first[0]))
+
+        return self.rebuilt(node, ['EXPRESSION', sign, items[0][1]] + [('PLUS' if signs > 0 else 'MINUS', term) for signs, term in items[1:]])
+
+    def negated(self, term):
+        # The term multiplied by -1, if it has a constant factor to absorb it.
+        items = factors(term)
+
+        for index, factor in enumerate(items or ()):
+            if factor[0] == 'NUMBER':
+                return product(items[:index] + [number(-factor[1])] + items[index + 1:])
+
+    def accept_term(self, node):
+        items = []
+
+        for factor in [node[1]] + [factor for operator, factor in node[2:]]:
+            factor = self.visit_node(factor)
+
+            if factor[0] == 'EXPRESSION' and constant(factor) is not None:
+                factor = number(constant(factor))
+
+            items.append(factor)
+
+        operators = [operator for operator, factor in node[2:]]
+
+        if any(operator != 'TIMES' for operator in operators):
+            return self.rebuilt(node, ['TERM', items[0]] + list(zip(operators, items[1:])))
+
+        # Parentheses within a product are flattened into it.
+        flattened = []
+        for factor in items:
+            if factor[0] == 'EXPRESSION' and factor[1] is None and len(factor) == 3 and factors(factor[2]):
+                flattened.extend(factors(factor[2]))
+            else:
+                flattened.append(factor)
+
+        # Constants are multiplied together in the place of the first one.
+        items = []
+        value = 1
+        position = None
+
+        for factor in flattened:
+            if factor[0] == 'NUMBER':
+                value *= factor[1]
+
+                if position is None:
+                    position = len(items)
+                    items.append(None)
+            else:
+                items.append(factor)
+
+        if position is not None:
+            if value == 0:
+                items = [number(0)]
+            elif value == 1 and len(items) > 1:
+                del items[position]
+            else:
+                items[position] = number(value)
+
+        return self.rebuilt(node, product(items))
+
+    def accept_number(self, node):
+        return node
+
+    def accept_name(self, node):
+        try:
+            defined, value, level = self.find(node[1])
+        except NameError:
+            # Left for the backend to report.
+            return node
+
+        if defined == 'VARIABLE':
+            value = self.known.get(node[1])
+        elif self.dynamic and self.declarations.get(node[1]) != 1:
+            # A caller may declare the name again, and it would be found first.
+            return node
+
+        if defined in ('CONSTANT', 'VARIABLE') and value is not None:
+            return self.rebuilt(node, number(value))
+
+        return node
+
+if __name__ == '__main__':
+    code = sys.stdin.read()
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = parser.p_program()
+
+    pprint.pprint(Optimizer('--dynamic' in sys.argv).optimize(program))
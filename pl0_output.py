@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Destinations for the values printed by programs. Machines and the
+# interpreter write each value to their output, which is flushed when the
+# program halts, suspends or fails, and before DEBUG shows the machine state.
+
+import sys
+
+class Output:
+    """
+    Collects printed values and writes them to a stream, one per line,
+    once size values are pending. The stream defaults to whatever
+    sys.stdout is when the output is flushed.
+    """
+
+    SIZE = 4096
+
+    def __init__(self, stream = None, size = None):
+        self.stream = stream
+        self.size = size or self.SIZE
+        self.pending = []
+
+    def write(self, value):
+        self.pending.append(value)
+
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(map(str, self.pending)) + "\n")
+            self.pending = []
+
+class CaptureOutput:
+    """
+    Keeps printed values in memory, for programs which are embedded.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.write = self.values.append
+
+    def flush(self):
+        pass
+
+    def lines(self):
+        return [str(value) for value in self.values]
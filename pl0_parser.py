@@ -26,6 +26,33 @@ import pl0_lexer
 
 class ParseError(Exception):
     pass
+
+class Node(tuple):
+    """
+    A node of the syntax tree, which records the line it begins on.
+    """
+
+class NodeList(list):
+    """
+    A node of the syntax tree whose children are appended as they are
+    parsed, which records the line it begins on.
+    """
+
+    __slots__ = ('line',)
+
+def locate(line, node):
+    # A copy of the node which records the line, see line_of().
+    if isinstance(node, list):
+        node = NodeList(node)
+    else:
+        node = Node(node)
+
+    node.line = line
+    return node
+
+def line_of(node):
+    # The line on which a node begins, or None if it wasn't parsed from source.
+    return getattr(node, 'line', None)
 
 class SymbolParser:
     def __init__(self, lex):
@@ -35,9 +62,22 @@ class SymbolParser:
 
     def input(self, data):
         self.source = "<input>"
+        self.lex.lineno = 1
         self.lex.input(data)
         self.sym = self.lex.token()
 
+    def line(self):
+        if self.sym:
+            return self.sym.lineno
+        else:
+            return self.lex.lineno
+
+    def located(self, line, node):
+        if node is not None:
+            node = locate(line, node)
+
+        return node
+
     def get_sym(self, name = None):
         # Get the next token
         self.sym = self.lex.token()
@@ -186,18 +226,20 @@ class Parser(SymbolParser):
             return None
 
     def p_statement(self):
+        line = self.line()
+
         if self.is_sym('NAME'):
-            return self.p_statement_assign()
+            return self.located(line, self.p_statement_assign())
         elif self.is_sym('CALL'):
-            return self.p_statement_call()
+            return self.located(line, self.p_statement_call())
         elif self.is_sym('BEGIN'):
-            return self.p_statement_begin()
+            return self.located(line, self.p_statement_begin())
         elif self.is_sym('IF'):
-            return self.p_statement_if()
+            return self.located(line, self.p_statement_if())
         elif self.is_sym('WHILE'):
-            return self.p_statement_while()
+            return self.located(line, self.p_statement_while())
         elif self.is_sym('PRINT'):
-            return self.p_statement_print()
+            return self.located(line, self.p_statement_print())
         else:
             # Raise an exception since we didn't find a valid statement.
             self.expect_sym('~statement')
@@ -287,6 +329,7 @@ class Parser(SymbolParser):
             return None
 
     def p_condition(self):
+        line = self.line()
         odd = False
 
         if self.is_sym('ODD'):
@@ -296,7 +339,7 @@ class Parser(SymbolParser):
         lhs = self.p_expression()
 
         if odd:
-            return ('ODD', lhs)
+            return self.located(line, ('ODD', lhs))
 
         elif self.sym.type in ['LT', 'LTE', 'GT', 'GTE', 'E', 'NE']:
             op = self.sym.type
@@ -304,7 +347,7 @@ class Parser(SymbolParser):
 
             rhs = self.p_expression()
 
-            return ('CONDITION', lhs, op, rhs,)
+            return self.located(line, ('CONDITION', lhs, op, rhs,))
         else:
             self.expect_sym('~comparison-operator')
 
@@ -321,9 +364,10 @@ class Parser(SymbolParser):
             return None
 
     def p_expression(self):
-        sign = self.p_term_op()
+        expression = self.located(self.line(), ['EXPRESSION'])
 
-        expression = ['EXPRESSION', sign]
+        sign = self.p_term_op()
+        expression.append(sign)
         lhs = self.required(self.p_term(), 'lhs-term')
 
         expression.append(lhs)
@@ -351,7 +395,7 @@ class Parser(SymbolParser):
             return None
 
     def p_term(self):
-        expression = ['TERM']
+        expression = self.located(self.line(), ['TERM'])
         lhs = self.required(self.p_factor(), 'lhs-factor')
 
         expression.append(lhs)
@@ -367,14 +411,16 @@ class Parser(SymbolParser):
             expression.append((operator, operand,))
 
     def p_factor(self):
+        line = self.line()
+
         if self.is_sym('NAME'):
             value = self.sym.value
             self.get_sym()
-            return ('NAME', value)
+            return self.located(line, ('NAME', value))
         elif self.is_sym('NUMBER'):
             value = self.sym.value
             self.get_sym()
-            return ('NUMBER', value)
+            return self.located(line, ('NUMBER', value))
         elif self.is_sym('LPAREN'):
             self.get_sym()
             expression = self.required(self.p_expression(), 'expression')
@@ -389,14 +435,14 @@ def is_flat(tree):
         return False
 
     for val in tree:
-        if type(val) in (list, dict, tuple):
+        if isinstance(val, (list, dict, tuple)):
             return False
     return True
 
 def print_tree(tree, depth = 0):
     if is_flat(tree):
         print("  " * depth + str(tree))
-    elif type(tree) == list or type(tree) == tuple:
+    elif isinstance(tree, (list, tuple)):
         print_tree(tree[0], depth)
         for val in tree[1:]:
             print_tree(val, depth+1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Runs many independent programs across a pool of worker processes. Each
+# job is either PL/0 source, which is parsed, compiled and assembled in the
+# worker, or a binary image written by pl0_assembler.py --binary. Results
+# are returned in the order the jobs complete.
+
+import sys
+import time
+import StringIO
+import argparse
+import traceback
+import multiprocessing
+import pl0_parser
+import pl0_compiler
+import pl0_assembler
+import pl0_machine
+import pl0_bytecode
+
+# The parser of this worker, created once so that its lexer is reused by every job.
+parser = None
+
+def initialize():
+    global parser
+    parser = pl0_parser.Parser()
+
+def capture(function, *arguments):
+    buffer = StringIO.StringIO()
+    stdout, sys.stdout = sys.stdout, buffer
+    try:
+        function(*arguments)
+    finally:
+        sys.stdout = stdout
+
+    return buffer.getvalue()
+
+class Stopwatch:
+    def __init__(self):
+        self.timings = []
+        self.last = time.time()
+
+    def lap(self, name):
+        now = time.time()
+        self.timings.append((name, now - self.last))
+        self.last = now
+
+def load_source(path, stopwatch):
+    if parser is None:
+        initialize()
+
+    source = open(path).read()
+
+    parser.lex.lineno = 1
+    parser.input(source)
+    program = parser.p_program()
+    stopwatch.lap('parse')
+
+    # The compiler emits straight into the assembler, without assembly text.
+    assembler = pl0_assembler.Assembler()
+    pl0_compiler.Compiler(assembler).generate(program)
+    stopwatch.lap('compile')
+
+    return pl0_machine.Machine(assembler.code())
+
+def load_binary(path, stopwatch):
+    image = pl0_bytecode.load_image(path)
+    stopwatch.lap('load')
+
+    return pl0_machine.Machine.from_image(pl0_machine.fuse(image))
+
+def run_job(path):
+    # Returns a dictionary, so that results can be sent back from the worker.
+    stopwatch = Stopwatch()
+    result = {'path': path, 'output': '', 'error': None}
+
+    try:
+        if path.endswith('.pl0b'):
+            machine = load_binary(path, stopwatch)
+        else:
+            machine = load_source(path, stopwatch)
+
+        result['output'] = capture(machine.run_fast)
+        stopwatch.lap('run')
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    result['timings'] = stopwatch.timings
+    result['time'] = sum(duration for name, duration in stopwatch.timings)
+
+    return result
+
+def run_jobs(paths, processes = None):
+    # Yields the result of each job as soon as it completes.
+    pool = multiprocessing.Pool(processes, initialize)
+
+    try:
+        for result in pool.imap_unordered(run_job, paths):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def summary(results, duration, processes):
+    busy = sum(result['time'] for result in results)
+    failed = len([result for result in results if result['error']])
+
+    return "%d jobs (%d failed) in %.3fs, %.1f jobs/s, %.3fs of work on %d processes, %.2fx" % (
+        len(results), failed, duration, len(results) / duration, busy, processes, busy / duration)
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description = 'Run PL/0 programs on a pool of processes')
+    arguments.add_argument('paths', nargs = '+', help = 'PL/0 source files, or binary images ending in .pl0b')
+    arguments.add_argument('-j', '--processes', type = int, default = multiprocessing.cpu_count())
+    arguments.add_argument('-o', '--output', action = 'store_true', help = 'print the output of each job')
+    options = arguments.parse_args()
+
+    results = []
+    start = time.time()
+
+    for result in run_jobs(options.paths, options.processes):
+        results.append(result)
+
+        timings = " ".join("%s %.2fms" % (name, duration * 1000) for name, duration in result['timings'])
+        print "%-32s %8.2fms  %s" % (result['path'], result['time'] * 1000, timings)
+
+        if result['error']:
+            sys.stdout.write(result['error'])
+        elif options.output:
+            sys.stdout.write(result['output'])
+
+        sys.stdout.flush()
+
+    print summary(results, time.time() - start, options.processes)
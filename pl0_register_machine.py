@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# A virtual machine with three-address instructions, see RegisterCompiler in
+# pl0_compiler. Each instruction is a tuple of (opcode, a, b, c); register
+# operands are indices into the register file, and the last operand of most
+# instructions may instead be a constant, which selects the K form.
+#
+#	ADD d a b	r[d] = r[a] + r[b]
+#	ADDK d a k	r[d] = r[a] + k
+#	JLT a b l	if r[a] < r[b]: jump to l
+#	JEVEN a l	if r[a] is even: jump to l
+#	SAVE a		push r[a] onto the saved values
+#	RESTORE a	pop r[a] from the saved values
+
+import sys
+import re
+import pl0_output
+
+OPCODES = {
+    'NOP': 0,
+    'HALT': 1,
+
+    'MOV': 2,
+    'MOVK': 3,
+
+    'JMP': 4,
+    'CALL': 5,
+    'RET': 6,
+
+    'PRINT': 8,
+    'PRINTK': 9,
+
+    'ADD': 10,
+    'ADDK': 11,
+    'SUB': 12,
+    'SUBK': 13,
+    'MUL': 14,
+    'MULK': 15,
+    'DIV': 16,
+    'DIVK': 17,
+
+    'JLT': 20,
+    'JLTK': 21,
+    'JLTE': 22,
+    'JLTEK': 23,
+    'JE': 24,
+    'JEK': 25,
+    'JNE': 26,
+    'JNEK': 27,
+    'JGTE': 28,
+    'JGTEK': 29,
+    'JGT': 30,
+    'JGTK': 31,
+
+    'JEVEN': 32,
+
+    # The locals of a procedure are saved on entry and restored on return, so recursion works.
+    'SAVE': 33,
+    'RESTORE': 34,
+}
+
+NAMES = dict((v,k) for k, v in OPCODES.iteritems())
+
+# The operand kinds of each instruction: register, constant or label.
+FORMS = {
+    'NOP': '', 'HALT': '', 'RET': '',
+    'MOV': 'rr', 'MOVK': 'rk',
+    'JMP': 'l', 'CALL': 'l',
+    'PRINT': 'r', 'PRINTK': 'k',
+    'JEVEN': 'rl',
+    'SAVE': 'r', 'RESTORE': 'r',
+}
+
+for name in ('ADD', 'SUB', 'MUL', 'DIV'):
+    FORMS[name] = 'rrr'
+    FORMS[name + 'K'] = 'rrk'
+
+for name in ('JLT', 'JLTE', 'JE', 'JNE', 'JGTE', 'JGT'):
+    FORMS[name] = 'rrl'
+    FORMS[name + 'K'] = 'rkl'
+
+comment_re = re.compile(r'^\s*#')
+label_re = re.compile(r'^\s*([a-zA-Z_][a-zA-Z0-9_]*):\s*$')
+
+class AssemblerError(Exception):
+    pass
+
+def is_integer(string):
+    return re.match(r'^[-+]?\d+$', string) is not None
+
+def assemble(input):
+    # Returns the instructions and the names of the registers.
+    lines = []
+    labels = {}
+    registers = {}
+
+    for line in input:
+        if comment_re.match(line) or line.strip() == '':
+            continue
+
+        match = label_re.match(line)
+
+        if match:
+            labels[match.group(1)] = len(lines)
+        else:
+            words = line.split()
+
+            if words[0] == 'VAR':
+                registers.setdefault(words[1], len(registers))
+            else:
+                lines.append(words)
+
+    code = []
+    for words in lines:
+        name, arguments = words[0], words[1:]
+
+        kinds = ''
+        for argument in arguments:
+            if is_integer(argument):
+                kinds += 'k'
+            elif argument in labels:
+                kinds += 'l'
+            else:
+                kinds += 'r'
+
+        # Select the K form if the last operand is a constant.
+        if FORMS.get(name) != kinds and FORMS.get(name + 'K') == kinds:
+            name += 'K'
+
+        if FORMS.get(name) != kinds:
+            raise AssemblerError("Invalid operands for %s: %s" % (name, " ".join(arguments)))
+
+        operands = []
+        for kind, argument in zip(kinds, arguments):
+            if kind == 'k':
+                operands.append(int(argument))
+            elif kind == 'l':
+                operands.append(labels[argument])
+            else:
+                # Temporaries are allocated on first use.
+                operands.append(registers.setdefault(argument, len(registers)))
+
+        operands += [None] * (3 - len(operands))
+        code.append((OPCODES[name],) + tuple(operands))
+
+    names = [None] * len(registers)
+    for name, index in registers.iteritems():
+        names[index] = name
+
+    return code, names
+
+class RegisterMachine:
+    def __init__(self, code, names, output = None):
+        self.code = code
+        self.output = output or pl0_output.Output()
+        self.names = names
+        self.registers = [0] * len(names)
+
+        # Return addresses are kept apart from the registers, and so are saved locals.
+        self.returns = []
+        self.saved = []
+        self.pc = 0
+
+    def halted(self):
+        return self.pc < 0
+
+    def dispatch_table(self):
+        table = [None] * (max(NAMES) + 1)
+
+        for opcode, name in NAMES.iteritems():
+            table[opcode] = getattr(self, "execute_%s" % name.lower())
+
+        return table
+
+    def run(self):
+        table = self.dispatch_table()
+        code = self.code
+        pc = self.pc
+
+        try:
+            while pc >= 0:
+                instruction = code[pc]
+                pc = table[instruction[0]](instruction, pc)
+        finally:
+            self.output.flush()
+
+        self.pc = pc
+
+    def execute_nop(self, instruction, pc):
+        return pc + 1
+
+    def execute_halt(self, instruction, pc):
+        self.output.flush()
+        return -1
+
+    def execute_mov(self, instruction, pc):
+        opcode, d, a, unused = instruction
+        registers = self.registers
+        registers[d] = registers[a]
+        return pc + 1
+
+    def execute_movk(self, instruction, pc):
+        opcode, d, k, unused = instruction
+        self.registers[d] = k
+        return pc + 1
+
+    def execute_jmp(self, instruction, pc):
+        return instruction[1]
+
+    def execute_call(self, instruction, pc):
+        self.returns.append(pc + 1)
+        return instruction[1]
+
+    def execute_ret(self, instruction, pc):
+        return self.returns.pop()
+
+    def execute_save(self, instruction, pc):
+        self.saved.append(self.registers[instruction[1]])
+        return pc + 1
+
+    def execute_restore(self, instruction, pc):
+        self.registers[instruction[1]] = self.saved.pop()
+        return pc + 1
+
+    def execute_print(self, instruction, pc):
+        self.output.write(self.registers[instruction[1]])
+        return pc + 1
+
+    def execute_printk(self, instruction, pc):
+        self.output.write(instruction[1])
+        return pc + 1
+
+    def execute_add(self, instruction, pc):
+        opcode, d, a, b = instruction
+        registers = self.registers
+        registers[d] = registers[a] + registers[b]
+        return pc + 1
+
+    def execute_addk(self, instruction, pc):
+        opcode, d, a, k = instruction
+        registers = self.registers
+        registers[d] = registers[a] + k
+        return pc + 1
+
+    def execute_sub(self, instruction, pc):
+        opcode, d, a, b = instruction
+        registers = self.registers
+        registers[d] = registers[a] - registers[b]
+        return pc + 1
+
+    def execute_subk(self, instruction, pc):
+        opcode, d, a, k = instruction
+        registers = self.registers
+        registers[d] = registers[a] - k
+        return pc + 1
+
+    def execute_mul(self, instruction, pc):
+        opcode, d, a, b = instruction
+        registers = self.registers
+        registers[d] = registers[a] * registers[b]
+        return pc + 1
+
+    def execute_mulk(self, instruction, pc):
+        opcode, d, a, k = instruction
+        registers = self.registers
+        registers[d] = registers[a] * k
+        return pc + 1
+
+    def execute_div(self, instruction, pc):
+        opcode, d, a, b = instruction
+        registers = self.registers
+        registers[d] = registers[a] / registers[b]
+        return pc + 1
+
+    def execute_divk(self, instruction, pc):
+        opcode, d, a, k = instruction
+        registers = self.registers
+        registers[d] = registers[a] / k
+        return pc + 1
+
+    def execute_jlt(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] < registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jltk(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] < k:
+            return address
+        return pc + 1
+
+    def execute_jlte(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] <= registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jltek(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] <= k:
+            return address
+        return pc + 1
+
+    def execute_je(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] == registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jek(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] == k:
+            return address
+        return pc + 1
+
+    def execute_jne(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] != registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jnek(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] != k:
+            return address
+        return pc + 1
+
+    def execute_jgte(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] >= registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jgtek(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] >= k:
+            return address
+        return pc + 1
+
+    def execute_jgt(self, instruction, pc):
+        opcode, a, b, address = instruction
+        registers = self.registers
+        if registers[a] > registers[b]:
+            return address
+        return pc + 1
+
+    def execute_jgtk(self, instruction, pc):
+        opcode, a, k, address = instruction
+        if self.registers[a] > k:
+            return address
+        return pc + 1
+
+    def execute_jeven(self, instruction, pc):
+        opcode, a, address, unused = instruction
+        if self.registers[a] % 2 == 0:
+            return address
+        return pc + 1
+
+    def debug(self):
+        self.output.flush()
+
+        print "-- Machine State --"
+
+        # Temporaries are named %0, %1, ...
+        variables = dict((name, value) for name, value in zip(self.names, self.registers) if not name.startswith('%'))
+        print "Registers: " + `variables`
+        print "Offset: " + `self.pc`
+
+if __name__ == '__main__':
+    code, names = assemble(sys.stdin)
+    machine = RegisterMachine(code, names)
+    machine.run()
+    machine.debug()
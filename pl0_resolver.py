@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import sys
+import pprint
+import pl0_parser
+from pl0_node_visitor import StackingNodeVisitor
+
+class Resolver(StackingNodeVisitor):
+    """
+    Annotates the syntax tree with the lexical address of every name. Each
+    block gets one slot per constant, variable and procedure it declares,
+    and NAME, SET and CALL nodes get a trailing (depth, slot) pair, where
+    depth is the number of static links to follow from the current frame.
+    Blocks get two trailing elements, the (name, kind) of each slot and the
+    initial value of each slot, which for procedures is the resolved block.
+    """
+
+    def resolve(self, program):
+        return self.visit_node(program)
+
+    def address(self, name, kind):
+        defined, slot, level = self.find(name)
+
+        if defined != kind:
+            return None
+
+        return (-level - 1, slot)
+
+    def accept_node(self, *node):
+        # Everything else is copied, with its children resolved.
+        children = [self.visit_node(child) if isinstance(child, (list, tuple)) else child for child in node[1:]]
+
+        return type(node)([node[0]] + children)
+
+    def accept_block(self, nid, constants, variables, procedures, statement):
+        self.push()
+
+        names = []
+        values = []
+
+        def allocate(name, kind, value):
+            names.append((name, kind))
+            values.append(value)
+            return len(names) - 1
+
+        for var in (constants or [])[1:]:
+            self.stack[-1].define(var[1], allocate(var[1], 'CONSTANT', var[2]))
+
+        for var in (variables or [])[1:]:
+            self.stack[-1].update(var[1], allocate(var[1], 'VARIABLE', 0))
+
+        # All procedures are declared before any are resolved, so they can call each other.
+        slots = []
+        for proc in (procedures or [])[1:]:
+            slots.append(allocate(proc[1], 'PROCEDURE', None))
+            self.stack[-1].declare(proc[1], slots[-1])
+
+        if procedures:
+            resolved = ['PROCEDURES']
+
+            for slot, proc in zip(slots, procedures[1:]):
+                values[slot] = self.visit_node(proc[2])
+                resolved.append(('PROCEDURE', proc[1], values[slot]))
+
+            procedures = resolved
+
+        statement = self.visit_node(statement)
+
+        self.pop()
+
+        return (nid, constants, variables, procedures, statement, tuple(names), tuple(values))
+
+    def accept_name(self, nid, name):
+        address = self.address(name, 'VARIABLE') or self.address(name, 'CONSTANT')
+
+        if address is None:
+            raise NameError("Invalid value name " + name + " of type " + self.find(name)[0])
+
+        return (nid, name, address)
+
+    def accept_set(self, nid, target, expression):
+        name = target[1]
+        address = self.address(name, 'VARIABLE')
+
+        if address is None:
+            raise NameError("Invalid assignment to non-variable " + name + " of type " + self.find(name)[0])
+
+        return (nid, target, self.visit_node(expression), address)
+
+    def accept_call(self, nid, name):
+        address = self.address(name, 'PROCEDURE')
+
+        if address is None:
+            raise NameError("Expecting procedure but got: " + self.find(name)[0])
+
+        return (nid, name, address)
+
+if __name__ == '__main__':
+    code = sys.stdin.read()
+    parser = pl0_parser.Parser()
+    parser.input(code)
+    program = parser.p_program()
+
+    pprint.pprint(Resolver().resolve(program))
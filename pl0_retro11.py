@@ -27,6 +27,7 @@ import os
 import sys
 #import StringIO
 import pl0_parser
+import pl0_optimizer
 from pl0_node_visitor import StackingNodeVisitor
 
 # AST->parable translator for operators
@@ -236,5 +237,9 @@ if __name__ == '__main__':
         parser = pl0_parser.Parser()
         parser.input(code)
         program = parser.p_program()
+
+        if '--optimize' in sys.argv:
+            program = pl0_optimizer.Optimizer().optimize(program)
+
         compiler = Compiler()
         compiler.generate(program)
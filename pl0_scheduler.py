@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import ast
+import sys
+import time
+import collections
+import pl0_parser
+import pl0_machine
+import pl0_bytecode
+import pl0_resolver
+import pl0_interpreter
+
+class Task:
+    def __init__(self, name, machine):
+        self.name = name
+        self.machine = machine
+        self.status = pl0_machine.SUSPENDED
+        self.error = None
+
+        # Accounting for the time slices given to this machine.
+        self.slices = 0
+        self.steps = 0
+        self.cpu_time = 0.0
+        self.longest = 0.0
+
+        # From being spawned until it finished, for latency.
+        self.spawned = time.time()
+        self.completed = None
+
+    def latency(self):
+        return (self.completed or time.time()) - self.spawned
+
+    def resume(self, scheduler):
+        return self.machine.run_fast(scheduler.quantum)
+
+    def cancel(self):
+        self.machine.output.flush()
+
+class ProgramTask(Task):
+    # A program run by pl0_interpreter.CooperativeInterpreter, in time slices rather than steps.
+
+    def resume(self, scheduler):
+        return self.machine.resume(scheduler.slice)
+
+    def cancel(self):
+        self.machine.cancel()
+
+class Scheduler:
+    """
+    Runs many machines in one process by giving each a time slice of at
+    most `quantum` steps in turn, round-robin. Machines are suspended with
+    run_fast(max_steps) and resumed on their next turn, so a long-running
+    program can't hold up the others. Interpreted programs, added with
+    spawn_program(), get slices of `slice` seconds instead.
+
+    This tree targets Python 2, which has no asyncio, so the scheduler is
+    driven by run(), or one slice at a time through step() from whatever
+    event loop hosts it.
+    """
+
+    def __init__(self, quantum = 1000, slice = None):
+        self.quantum = quantum
+        self.slice = slice or pl0_interpreter.CooperativeInterpreter.SLICE
+        self.queue = collections.deque()
+        self.finished = []
+
+        self.steps = 0
+        self.elapsed = 0.0
+
+    def spawn(self, machine, name = None, task_class = Task):
+        task = task_class(name or "vm-%d" % (len(self.queue) + len(self.finished)), machine)
+        self.queue.append(task)
+        return task
+
+    def spawn_program(self, program, name = None, output = None):
+        # Interprets a parsed program.
+        program = pl0_resolver.Resolver().resolve(program)
+        interpreter = pl0_interpreter.CooperativeInterpreter(program, output, self.slice)
+
+        return self.spawn(interpreter, name, ProgramTask)
+
+    def cancel(self, task):
+        if task.status != pl0_machine.SUSPENDED:
+            return
+
+        self.queue.remove(task)
+        task.cancel()
+        self.complete(task, pl0_machine.CANCELLED)
+
+    def complete(self, task, status):
+        task.status = status
+        task.completed = time.time()
+        self.finished.append(task)
+
+    def step(self):
+        # Gives the machine at the front of the queue one time slice. Returns False once every machine has halted.
+        if not self.queue:
+            return False
+
+        task = self.queue.popleft()
+        machine = task.machine
+
+        steps = machine.steps
+        wall = time.time()
+        cpu = time.clock()
+
+        # A program which fails is finished, and doesn't stop the others.
+        try:
+            status = task.resume(self)
+        except Exception, error:
+            task.error = error
+            status = pl0_machine.FAILED
+
+        wall = time.time() - wall
+
+        task.cpu_time += time.clock() - cpu
+        task.slices += 1
+        task.steps += machine.steps - steps
+        task.longest = max(task.longest, wall)
+
+        self.steps += machine.steps - steps
+        self.elapsed += wall
+
+        if status == pl0_machine.SUSPENDED:
+            self.queue.append(task)
+        else:
+            self.complete(task, status)
+
+        return True
+
+    def run(self):
+        while self.step():
+            pass
+
+    def statistics(self):
+        steps_per_second = 0.0
+        if self.elapsed:
+            steps_per_second = self.steps / self.elapsed
+
+        tasks = list(self.queue) + self.finished
+
+        return {
+            'longest_slice': max([task.longest for task in tasks] or [0.0]),
+            'queue_depth': len(self.queue),
+            'finished': len(self.finished),
+            'steps': self.steps,
+            'steps_per_second': round(steps_per_second),
+        }
+
+    def accounting(self):
+        # Per machine usage, for both running and finished machines.
+        tasks = list(self.queue) + self.finished
+
+        return [(task.name, task.status, task.slices, task.steps, task.cpu_time) for task in tasks]
+
+if __name__ == '__main__':
+    # Runs each program given on the command line, all at once. Source
+    # files are interpreted, and anything else is an assembled program,
+    # either a binary image or the sequence written by pl0_assembler.py.
+    scheduler = Scheduler()
+
+    for path in sys.argv[1:]:
+        if path.endswith('.pl0'):
+            parser = pl0_parser.Parser()
+            parser.input(open(path).read())
+            scheduler.spawn_program(parser.p_program(), path)
+        else:
+            try:
+                machine = pl0_machine.Machine.from_image(pl0_machine.fuse(pl0_bytecode.load_image(path)))
+            except pl0_bytecode.FormatError:
+                machine = pl0_machine.Machine(ast.literal_eval(open(path).read()))
+
+            scheduler.spawn(machine, path)
+
+    scheduler.run()
+
+    for name, status, slices, steps, cpu_time in scheduler.accounting():
+        print "%s: %s after %d slices, %d steps, %.6fs" % (name, status, slices, steps, cpu_time)
+
+    for task in scheduler.finished:
+        if task.error:
+            print "%s: %s" % (task.name, task.error)
+
+    print "Scheduler: " + `scheduler.statistics()`
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2012 Samuel G. D. Williams. <http://www.oriontransfer.co.nz>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import time
+import collections
+import pl0_block_compiler
+from pl0_machine import *
+from pl0_block_compiler import Translator
+
+# The number of times a backward branch target must be reached before it is traced.
+THRESHOLD = 50
+
+# Jumps which can close a loop, when they branch backward.
+BRANCHES = (JMP, JLT, JLTE, JE, JNE, JGTE, JGT, JCMPVK)
+
+# Traces which grow beyond this many instructions are abandoned.
+MAXIMUM_LENGTH = 1000
+
+# A loop header is no longer traced after this many abandoned recordings.
+MAXIMUM_ATTEMPTS = 3
+
+# The loop headers and traces of each image, which are shared by every
+# machine running it, keyed by a hash of the image code, least recently used first.
+CACHE = collections.OrderedDict()
+CACHE_SIZE = 64
+
+class Profile:
+    def __init__(self):
+        # Loop headers, by instruction index.
+        self.counts = {}
+        self.traces = {}
+        self.attempts = {}
+        self.aborted = set()
+
+def profile(image, depth = None):
+    key = pl0_block_compiler.program_key(image)
+
+    # Traces for a FixedMachine are translated differently, see Translator.
+    if depth is not None:
+        key += ":%d" % depth
+
+    if key in CACHE:
+        result = CACHE.pop(key)
+    else:
+        result = Profile()
+
+        if len(CACHE) >= CACHE_SIZE:
+            CACHE.popitem(last = False)
+
+    CACHE[key] = result
+
+    return result
+
+class TraceTranslator(Translator):
+    """
+    Translates a recorded trace, a list of (pc, next_pc) pairs which starts
+    and ends at the same loop header, into a Python function which runs the
+    loop until a guard fails. Unconditional jumps, calls and returns are
+    followed as recorded, and each conditional branch becomes a guard which
+    leaves the trace towards the direction which was not recorded.
+    """
+
+    def __init__(self, image, trace, depth = None):
+        Translator.__init__(self, image, depth)
+        self.trace = trace
+
+    def side_exit(self, target):
+        # Pending values are pushed so the interpreter can resume at target.
+        for expression, variables in self.values:
+            self.emit("    append(%s)" % expression)
+
+        self.emit("    return %s, steps + %d" % (target, self.position + 1))
+
+    def branch(self, condition, address, i):
+        if self.next_pc == address:
+            self.emit("if not (%s):" % condition)
+            self.side_exit(i + 1)
+        else:
+            self.emit("if %s:" % condition)
+            self.side_exit(address)
+
+    def translate_jmp(self, address, i):
+        pass
+
+    def translate_call(self, address, i):
+        self.push(repr(self.image.addresses[i + 1]))
+
+    def translate_ret(self, operand, i):
+        expression, variables = self.materialize(self.pop())
+        expected = self.image.addresses[self.next_pc]
+
+        # Return addresses pushed within the trace are known statically.
+        if expression != repr(expected):
+            self.emit("if %s != %d:" % (expression, expected))
+            self.side_exit("index[%s]" % expression)
+
+    def translate_halt(self, operand, i):
+        raise ValueError("Traces can't contain HALT")
+
+    def translate_debug(self, operand, i):
+        raise ValueError("Traces can't contain DEBUG")
+
+    def translate(self):
+        self.lines = []
+        self.values = []
+
+        for self.position, (pc, self.next_pc) in enumerate(self.trace):
+            opcode, operand = self.image.code[pc]
+
+            method = getattr(self, "translate_%s" % NAMES[opcode].lower())
+            method(operand, pc)
+
+        self.flush()
+
+        source = [
+            "def trace(data, stack, index, frames, write):",
+        ] + self.prologue()
+
+        if self.image.data:
+            source.append("    %s, = data" % self.variables())
+
+        source += [
+            "    steps = 0",
+            "    try:",
+            "        while True:",
+        ]
+
+        source.extend("            " + line for line in self.check() + self.lines)
+        source.append("            steps += %d" % len(self.trace))
+
+        source += [
+            "    finally:",
+            "        data[:] = [%s]" % self.variables(),
+        ]
+
+        return "\n".join(source) + "\n"
+
+class Tracer:
+    def __init__(self, machine, threshold = None):
+        self.machine = machine
+        self.image = machine.image
+        self.threshold = threshold or THRESHOLD
+
+        # Loops which are hot in one run are traced once, for every later run of the same image.
+        shared = profile(self.image, machine.stack_limit())
+        self.counts = shared.counts
+        self.traces = shared.traces
+        self.attempts = shared.attempts
+        self.aborted = shared.aborted
+
+        self.entries = 0
+        self.iterations = 0
+        self.trace_steps = 0
+        self.trace_time = 0.0
+        self.record_time = 0.0
+        self.interpreted_steps = 0
+        self.interpreted_time = 0.0
+
+    def run(self, pc):
+        table = self.machine.dispatch_table()
+        code = self.image.code
+        counts = self.counts
+        traces = self.traces
+        aborted = self.aborted
+        threshold = self.threshold
+
+        while pc >= 0:
+            start = time.time()
+            steps = 0
+
+            # Interpret until a loop header which has a trace is reached.
+            while pc >= 0:
+                opcode, operand = code[pc]
+                target = table[opcode](operand, pc)
+                steps += 1
+
+                if 0 <= target <= pc and opcode in BRANCHES:
+                    if target in traces:
+                        pc = target
+                        break
+                    elif target not in aborted:
+                        counts[target] = counts.get(target, 0) + 1
+
+                        if counts[target] >= threshold:
+                            target = self.record(target, table)
+
+                            if target in traces:
+                                pc = target
+                                break
+
+                pc = target
+
+            self.interpreted_time += time.time() - start
+            self.interpreted_steps += steps
+
+            if pc >= 0:
+                pc = self.enter(pc)
+
+        return pc
+
+    def record(self, header, table):
+        # Execute from the loop header, recording the path taken, until it returns to the header.
+        start = time.time()
+        code = self.image.code
+        trace = []
+        pc = header
+
+        while len(trace) < MAXIMUM_LENGTH:
+            opcode, operand = code[pc]
+
+            if opcode in (HALT, DEBUG):
+                break
+
+            target = table[opcode](operand, pc)
+            trace.append((pc, target))
+
+            if target == header:
+                self.traces[header] = (self.compile(trace), len(trace))
+                self.record_time += time.time() - start
+                return target
+
+            # The path left this loop for an enclosing one, so try again on a later iteration.
+            if 0 <= target <= pc and opcode in BRANCHES:
+                pc = target
+                break
+
+            pc = target
+
+        self.record_time += time.time() - start
+
+        self.counts[header] = 0
+        self.attempts[header] = self.attempts.get(header, 0) + 1
+
+        if self.attempts[header] >= MAXIMUM_ATTEMPTS:
+            self.aborted.add(header)
+
+        return pc
+
+    def compile(self, trace):
+        source = TraceTranslator(self.image, trace, self.machine.stack_limit()).translate()
+
+        namespace = {'wrap': wrap, 'StackOverflowError': StackOverflowError}
+        exec compile(source, "<pl0 trace:%d>" % trace[0][0], 'exec') in namespace
+
+        return namespace['trace']
+
+    def enter(self, header):
+        function, length = self.traces[header]
+
+        start = time.time()
+        pc, steps = self.machine.call_translated(function, self.image.index, self.machine.frames, self.machine.output.write)
+        self.trace_time += time.time() - start
+
+        self.entries += 1
+        self.iterations += steps / length
+        self.trace_steps += steps
+
+        return pc
+
+    def statistics(self):
+        # Estimate the time saved from the average cost of an interpreted step.
+        saved = 0.0
+        if self.interpreted_steps:
+            rate = (self.interpreted_time - self.record_time) / self.interpreted_steps
+            saved = self.trace_steps * rate - self.trace_time - self.record_time
+
+        return {
+            'traces': len(self.traces),
+            'aborted': len(self.aborted),
+            'entries': self.entries,
+            'hits': self.iterations,
+            # Every entry leaves its trace through exactly one side exit.
+            'side_exits': self.entries,
+            'trace_steps': self.trace_steps,
+            'interpreted_steps': self.interpreted_steps,
+            'saved': round(saved, 6),
+        }